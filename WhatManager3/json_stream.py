@@ -0,0 +1,137 @@
+import codecs
+import json
+import re
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStreamException(Exception):
+    pass
+
+
+class StreamingArrayParser(object):
+    """
+    Incrementally parses a JSON document fed to it in chunks and passes the elements of one
+    array in it to a callback as soon as each of them is complete, so that a huge response never
+    has to be held in memory as a whole. The array is found by the keys of the objects that lead
+    to it, e.g. ('arguments', 'torrents'). The rest of the document is kept, with the array left
+    empty, and returned by close().
+
+    The outer objects are walked token by token, every other value is decoded in one go by the
+    C scanner of the json module once it has been received completely.
+    """
+
+    def __init__(self, path, callback):
+        self.path = tuple(path)
+        self.callback = callback
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        # Open containers, as [value, keys leading to it, key of the value being parsed]
+        self.stack = []
+        self.state = 'value'
+        self.root = None
+        self.done = False
+
+    def feed(self, data):
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data)
+        self.pos = 0
+        self._parse(False)
+
+    def close(self):
+        """
+        :return: The document without the elements of the array
+        """
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b'', True)
+        self.pos = 0
+        self._parse(True)
+        if not self.done or WHITESPACE.match(self.buffer, self.pos).end() != len(self.buffer):
+            raise JsonStreamException('Incomplete or invalid JSON document')
+        return self.root
+
+    def _decode(self, final):
+        """
+        :return: The value at the current position or None if it isn't complete yet. A value that
+        ends exactly at the end of the buffer may be a prefix of a longer number, so it is only
+        decoded once more data arrives or the document is complete.
+        """
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except ValueError:
+            if final:
+                raise JsonStreamException('Invalid JSON at {0}'.format(self.buffer[self.pos:][:50]))
+            return None
+        if end == len(self.buffer) and not final:
+            return None
+        self.pos = end
+        return value,
+
+    def _add(self, value):
+        if not self.stack:
+            self.root = value
+            self.done = True
+            return
+        # Only objects are open besides the array, whose elements don't go through here
+        frame = self.stack[-1]
+        frame[0][frame[2]] = value
+        self.state = 'after_value'
+
+    def _parse(self, final):
+        buffer = self.buffer
+        while not self.done:
+            self.pos = WHITESPACE.match(buffer, self.pos).end()
+            if self.pos == len(buffer):
+                return
+            c = buffer[self.pos]
+            frame = self.stack[-1] if self.stack else None
+            if self.state == 'value':
+                keys = frame[1] + (frame[2],) if frame else ()
+                if c == '[' and keys == self.path:
+                    self.pos += 1
+                    self.stack.append([[], keys, None])
+                    self.state = 'first_element'
+                elif c == '{' and keys == self.path[:len(keys)]:
+                    self.pos += 1
+                    self.stack.append([{}, keys, None])
+                    self.state = 'first_key'
+                else:
+                    value = self._decode(final)
+                    if value is None:
+                        return
+                    self._add(value[0])
+            elif self.state in ('first_key', 'key'):
+                if c == '}' and self.state == 'first_key':
+                    self.pos += 1
+                    self._add(self.stack.pop()[0])
+                    continue
+                if c != '"':
+                    raise JsonStreamException('Expected a key at {0}'.format(self.pos))
+                value = self._decode(final)
+                if value is None:
+                    return
+                frame[2] = value[0]
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if c != ':':
+                    raise JsonStreamException('Expected : at {0}'.format(self.pos))
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'first_element' and c == ']':
+                self.pos += 1
+                self._add(self.stack.pop()[0])
+            elif self.state in ('first_element', 'element'):
+                value = self._decode(final)
+                if value is None:
+                    return
+                self.callback(value[0])
+                self.state = 'after_value'
+            elif self.state == 'after_value':
+                self.pos += 1
+                if c == ',':
+                    self.state = 'key' if type(frame[0]) is dict else 'element'
+                elif c == ('}' if type(frame[0]) is dict else ']'):
+                    self._add(self.stack.pop()[0])
+                else:
+                    raise JsonStreamException('Unexpected {0} at {1}'.format(c, self.pos - 1))
@@ -14,8 +14,22 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 STORE_PATH = os.path.join(BASE_DIR, 'store')
+# 'files' stores each torrent in its own file, 'pack' appends them to large pack files
+TORRENT_STORE_BACKEND = 'files'
+# Let the web server send stored torrents: None, 'x-sendfile' or 'x-accel-redirect'. For
+# x-accel-redirect, STORE_SENDFILE_URL must be an internal nginx location aliased to STORE_PATH.
+STORE_SENDFILE = None
+STORE_SENDFILE_URL = '/protected/store/'
+# Byte budget of the per-process read cache of stored torrents, 0 disables it
+STORE_CACHE_BYTES = 64 * 1024 * 1024
+# Store the info dict of torrents that only differ in their announces once. Deduplicated
+# torrents are rebuilt in memory when they are read, so they are never handed to the web server
+# through STORE_SENDFILE or streamed from disk.
+STORE_DEDUP_INFO = False
 TRACKER_MANAGER_HOST = 'localhost'
 TRACKER_MANAGER_PORT = 11092
+# Byte budget of the per-process cache of parsed torrents, keyed by content digest
+TORRENT_INFO_CACHE_BYTES = 1024 * 1024
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.7/howto/deployment/checklist/
@@ -3,7 +3,9 @@ from datetime import datetime
 from django.test.testcases import TestCase
 import pytz
 
-from WhatManager3.utils import parse_db_datetime, html_unescape, json_loads, json_dumps
+from WhatManager3.json_stream import StreamingArrayParser, JsonStreamException
+from WhatManager3.utils import parse_db_datetime, html_unescape, json_loads, json_dumps, \
+    LRUCache
 
 
 class UtilsTestCase(TestCase):
@@ -17,3 +19,49 @@ class UtilsTestCase(TestCase):
     def test_json(self):
         text = '{"hi":"world"}'
         self.assertEqual(text, json_dumps(json_loads(text)))
+
+
+class LRUCacheTestCase(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(10)
+        cache.put('a', 1, 4)
+        cache.put('b', 2, 4)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3, 4)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.bytes, 8)
+        cache.put('d', 4, 11)
+        self.assertIsNone(cache.get('d'))
+        cache.discard('a')
+        self.assertEqual(cache.bytes, 4)
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+        self.assertEqual(cache.hit_ratio, 0.6)
+
+
+class StreamingArrayParserTestCase(TestCase):
+    def parse(self, text, chunk_size):
+        elements = []
+        parser = StreamingArrayParser(('arguments', 'torrents'), elements.append)
+        data = text.encode('utf-8')
+        for i in range(0, len(data), chunk_size):
+            parser.feed(data[i:i + chunk_size])
+        return parser.close(), elements
+
+    def test_split(self):
+        text = ('{"arguments": {"torrents": [{"a": "x\\"}],"}, [1, {"b": null}], 12, "\u00e9"],'
+                ' "removed": [1, 2]}, "result": "success"}')
+        for chunk_size in [1, 2, 3, 1000]:
+            document, elements = self.parse(text, chunk_size)
+            self.assertEqual(document, {'arguments': {'torrents': [], 'removed': [1, 2]},
+                                        'result': 'success'})
+            self.assertEqual(elements, [{'a': 'x"}],'}, [1, {'b': None}], 12, '\u00e9'])
+
+    def test_no_array(self):
+        for text in ['{"result": "error"}', '{"x": {"torrents": [1]}, "arguments": {}}']:
+            self.assertEqual(self.parse(text, 2), (json_loads(text), []))
+
+    def test_invalid(self):
+        for text in ['{"a": 1', '{"a": 1}}', '{"a" 1}', '{"arguments": {"torrents": [1,]}}']:
+            self.assertRaises(JsonStreamException, lambda: self.parse(text, 3))
@@ -1,14 +1,20 @@
+import shutil
+import tempfile
+from unittest import mock
+
 from django.contrib.auth.models import User
 
 from django.test.client import Client
 from django.utils import timezone
 
+from WhatManager3 import settings
 from WhatManager3.test_utils import TestCase, load_fixture
 
 from WhatManager3.utils import json_loads
 
 from torrents.models import TorrentManager, DownloadLocation, ClientInstance, ClientTorrent
 from torrents.utils import TorrentInfo
+from trackers.store import TorrentStore, PackTorrentStore, store_backends, shared_stores
 from trackers.whatcd.models import TrackerTorrent
 
 
@@ -109,3 +115,44 @@ class TorrentStatusTestCase(TestCase):
                 },
             }
         )
+
+
+class TorrentStoreGetTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.create_pack_store = mock.Mock(side_effect=lambda: PackTorrentStore(self.dir))
+        for patcher in [
+            mock.patch.dict(store_backends, {'pack': self.create_pack_store}),
+            mock.patch.dict(shared_stores, clear=True),
+            mock.patch.multiple(settings, TORRENT_STORE_BACKEND='pack', STORE_CACHE_BYTES=0,
+                                STORE_SENDFILE=None),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.store = TorrentStore.create()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        c = Client()
+        info = TorrentInfo.from_binary(music_torrent_data)
+        params = {
+            'announces_hash': info.announces_hash,
+            'info_hash': info.info_hash,
+        }
+        self.assertEqual(c.get('/api/torrents/store/get', params).status_code, 404)
+        self.store.put(music_torrent_data)
+        response = c.get('/api/torrents/store/get', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), music_torrent_data)
+        self.assertEqual(int(response['Content-Length']), len(music_torrent_data))
+        etag = response['ETag']
+        response = c.get('/api/torrents/store/get', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.store.delete(info.announces_hash, info.info_hash)
+        response = c.get('/api/torrents/store/get', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        # The ETag check and the view of every request use the same store, which loaded its
+        # index once
+        self.assertEqual(self.create_pack_store.call_count, 1)
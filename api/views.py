@@ -1,20 +1,30 @@
 # Create your views here.
 from functools import reduce
+import os.path
+from wsgiref.util import FileWrapper
 
 from django.contrib.auth.decorators import login_required
 
 from django.db.models.aggregates import Sum
 from django.db.models import Q
-from django.http.response import JsonResponse, HttpResponse
+from django.http import Http404
+from django.http.response import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, etag
 
 from api.management import ApiManager
 from torrents.client import TorrentManagerException
 from torrents.models import ClientTorrent, DownloadLocation
 from trackers.client import TrackerManagerException
 from trackers.loader import get_tracker_torrent_model
-from trackers.store import TorrentStore
+from trackers.store import TorrentStore, get_store_cache
+from WhatManager3 import settings
+
+try:
+    # Passed to wsgi.file_wrapper, so the server can use sendfile(). Added in Django 1.8.
+    from django.http.response import FileResponse
+except ImportError:
+    FileResponse = None
 
 
 @csrf_exempt
@@ -74,12 +84,44 @@ def torrents_status(request):
     return JsonResponse(statuses)
 
 
+def torrents_store_etag(request):
+    announces_hash = request.GET['announces_hash']
+    info_hash = request.GET['info_hash']
+    # Without an ETag a deleted torrent gets its 404 instead of a 304. create() returns the
+    # process-wide store, so this and the view share one loaded index.
+    if not TorrentStore.create().exists(announces_hash, info_hash):
+        return None
+    # Stored torrents never change, so the key identifies the content
+    return '{0}-{1}'.format(announces_hash, info_hash)
+
+
+@etag(torrents_store_etag)
 def torrents_store_get(request):
     store = TorrentStore.create()
     announces_hash = request.GET['announces_hash']
     info_hash = request.GET['info_hash']
-    return HttpResponse(store.get(announces_hash, info_hash),
-                        content_type='application/x-bittorrent')
+    if settings.STORE_SENDFILE:
+        file_path = store.get_file_path(announces_hash, info_hash)
+        if file_path is not None:
+            if not os.path.exists(file_path):
+                raise Http404()
+            response = HttpResponse(content_type='application/x-bittorrent')
+            if settings.STORE_SENDFILE == 'x-accel-redirect':
+                response['X-Accel-Redirect'] = settings.STORE_SENDFILE_URL + os.path.relpath(
+                    file_path, settings.STORE_PATH)
+            else:
+                response['X-Sendfile'] = file_path
+            return response
+    try:
+        f, size = store.open(announces_hash, info_hash)
+    except OSError:
+        raise Http404()
+    if FileResponse is not None:
+        response = FileResponse(f, content_type='application/x-bittorrent')
+    else:
+        response = StreamingHttpResponse(FileWrapper(f), content_type='application/x-bittorrent')
+    response['Content-Length'] = size
+    return response
 
 
 def site_stats(request):
@@ -97,4 +139,5 @@ def site_stats(request):
         'torrentsSize': total_size,
         'buffer': buffer,
         'downloadLocations': locations,
+        'storeCache': get_store_cache().stats() if settings.STORE_CACHE_BYTES else None,
     })
@@ -0,0 +1,20 @@
+import os.path
+import timeit
+
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'fixtures')
+
+
+def load_fixture(filename):
+    with open(os.path.join(FIXTURES_PATH, filename), 'rb') as f:
+        return f.read()
+
+
+def measure(name, func, number=100, repeat=5):
+    """
+    Runs func number times, repeat times and prints the best time per call.
+    :return: The best time per call in seconds
+    """
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print('{0:<50} {1:>12.1f} us'.format(name, best * 1000000))
+    return best
@@ -0,0 +1,45 @@
+"""
+Compares bdecode with bdecode_lazy on the torrent fixtures and on an inflated torrent with a
+multi-megabyte pieces blob. Run from the project root with:
+
+    python3 -m benchmarks.bencode_decode
+"""
+import tracemalloc
+
+from benchmarks import load_fixture, measure
+from torrents import bencode
+
+
+def inflate(data, factor):
+    bdict = bencode.bdecode(data)
+    bdict[b'info'][b'pieces'] *= factor
+    return bencode.bencode(bdict)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def run():
+    samples = [
+        ('what.torrent', load_fixture('torrents/what.torrent')),
+        ('multi_tracker.torrent', load_fixture('torrents/multi_tracker.torrent')),
+    ]
+    samples.append(('what.torrent x200 pieces', inflate(samples[0][1], 200)))
+    for name, data in samples:
+        print('{0} ({1} bytes)'.format(name, len(data)))
+        measure('  bdecode', lambda: bencode.bdecode(data))
+        measure('  bdecode_lazy', lambda: bencode.bdecode_lazy(data))
+        print('  peak memory bdecode: {0} bytes, bdecode_lazy: {1} bytes'.format(
+            peak_memory(lambda: bencode.bdecode(data)),
+            peak_memory(lambda: bencode.bdecode_lazy(data)),
+        ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,66 @@
+"""
+Compares put, batched put_many and random read throughput of the file-per-torrent TorrentStore
+with the PackTorrentStore. Run from the project root, with a settings.py in place, with:
+
+    python3 -m benchmarks.store [count]
+"""
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import load_fixture
+from torrents import bencode
+from torrents.utils import TorrentInfo
+from trackers.store import TorrentStore, PackTorrentStore
+
+
+def make_torrents(count):
+    bdict = bencode.bdecode(load_fixture('torrents/what.torrent'))
+    torrents = []
+    for i in range(count):
+        bdict[b'info'][b'name'] = 'Torrent {0}'.format(i).encode()
+        torrents.append(bencode.bencode(bdict))
+    return torrents
+
+
+BATCH_SIZE = 100
+
+
+def run_store(name, store, batch_store, torrents, keys, reads):
+    start = time.time()
+    for torrent in torrents:
+        store.put(torrent)
+    put_time = time.time() - start
+    start = time.time()
+    for i in range(0, len(torrents), BATCH_SIZE):
+        batch_store.put_many(torrents[i:i + BATCH_SIZE])
+    put_many_time = time.time() - start
+    start = time.time()
+    for i in range(reads):
+        store.get(*random.choice(keys))
+    read_time = time.time() - start
+    print('{0:<20} put {1:>8.0f}/s   put_many {2:>8.0f}/s   random get {3:>8.0f}/s'.format(
+        name, len(torrents) / put_time, len(torrents) / put_many_time, reads / read_time))
+
+
+def run(count):
+    torrents = make_torrents(count)
+    keys = []
+    for torrent in torrents:
+        info = TorrentInfo.from_binary_cached(torrent)
+        keys.append((info.announces_hash, info.info_hash))
+    for name, store_class in [('TorrentStore', TorrentStore),
+                              ('PackTorrentStore', PackTorrentStore)]:
+        dir = tempfile.mkdtemp()
+        batch_dir = tempfile.mkdtemp()
+        try:
+            run_store(name, store_class(dir), store_class(batch_dir), torrents, keys, count * 2)
+        finally:
+            shutil.rmtree(dir)
+            shutil.rmtree(batch_dir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
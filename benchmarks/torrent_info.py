@@ -0,0 +1,52 @@
+"""
+Compares TorrentInfo.from_binary, which only decodes announce and announce-list and hashes the
+raw info span, with fully decoding and re-encoding the torrent. Run from the project root with:
+
+    python3 -m benchmarks.torrent_info
+"""
+import tracemalloc
+
+from benchmarks import load_fixture, measure
+from torrents import bencode
+from torrents.utils import TorrentInfo
+
+
+def many_files(data, count):
+    bdict = bencode.bdecode(data)
+    bdict[b'info'][b'files'] = [
+        {b'length': i, b'path': [b'CD1', '{0:05} - Track.flac'.format(i).encode()]}
+        for i in range(count)
+    ]
+    return bencode.bencode(bdict)
+
+
+def full_decode(data):
+    return TorrentInfo(bencode.bdecode(data))
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run():
+    what_torrent = load_fixture('torrents/what.torrent')
+    samples = [
+        ('what.torrent', what_torrent),
+        ('what.torrent with 50000 files', many_files(what_torrent, 50000)),
+    ]
+    for name, data in samples:
+        print('{0} ({1} bytes)'.format(name, len(data)))
+        measure('  bdecode + bencode(info)', lambda: full_decode(data), number=5)
+        measure('  TorrentInfo.from_binary', lambda: TorrentInfo.from_binary(data), number=5)
+        print('  peak memory full: {0} bytes, from_binary: {1} bytes'.format(
+            peak_memory(lambda: full_decode(data)),
+            peak_memory(lambda: TorrentInfo.from_binary(data)),
+        ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,74 @@
+"""
+Measures the memory used per Torrent record, as built by a full update, compared with the
+previous dict-backed record that kept its own copy of the path and announce strings. Run from
+the project root with:
+
+    python3 -m benchmarks.torrent_memory
+"""
+from datetime import datetime
+import tracemalloc
+
+import pytz
+
+from torrents.backends.base import Torrent, FieldInterner
+
+
+COUNT = 200000
+
+
+class DictTorrent(object):
+    def __init__(self, info_hash, path, name, size_bytes, uploaded_bytes, done, date_added, error,
+                 announces):
+        self.info_hash = info_hash
+        self.path = path
+        self.name = name
+        self.size_bytes = size_bytes
+        self.uploaded_bytes = uploaded_bytes
+        self.done = done
+        self.date_added = date_added
+        self.error = error
+        self.announces = announces
+
+
+def make_torrents(count, record, interner=None):
+    torrents = []
+    for i in range(count):
+        # Build fresh strings every time, the same way decoding the RPC response does
+        path = ''.join(['/mnt/', 'storage', '/what.cd'])
+        announces = [[''.join(['http://tracker.what.cd:34000/', 'passkey/announce'])]]
+        if interner is not None:
+            path = interner.intern_path(path)
+            announces = interner.intern_announces(announces)
+        torrents.append(record(
+            '{0:040X}'.format(i),
+            path,
+            'Some Artist - Some Album (2014) [FLAC] {0}'.format(i),
+            i * 1000,
+            i * 2000,
+            1.0,
+            datetime.fromtimestamp(1400000000 + i, tz=pytz.UTC),
+            None,
+            announces,
+        ))
+    return torrents
+
+
+def bytes_per_torrent(*args):
+    tracemalloc.start()
+    torrents = make_torrents(COUNT, *args)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del torrents
+    return used / COUNT
+
+
+def run():
+    print('{0} torrents'.format(COUNT))
+    print('  dict-backed:          {0:.0f} bytes per torrent'.format(
+        bytes_per_torrent(DictTorrent)))
+    print('  slotted and interned: {0:.0f} bytes per torrent'.format(
+        bytes_per_torrent(Torrent, FieldInterner())))
+
+
+if __name__ == '__main__':
+    run()
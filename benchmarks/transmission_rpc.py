@@ -0,0 +1,40 @@
+"""
+Measures the latency of Transmission RPCs made through a pooled keep-alive connection and through
+a new connection per RPC. Needs a running Transmission. Run from the project root, with a
+settings.py in place, with:
+
+    python3 -m benchmarks.transmission_rpc [host] [port] [count]
+"""
+import asyncio
+import sys
+
+import aiohttp
+
+from torrents.backends.transmission import TorrentClient
+
+
+@asyncio.coroutine
+def run_client(name, client, count, reconnect):
+    yield from client.start()
+    for i in range(count):
+        if reconnect:
+            client.connector.close()
+            client.connector = aiohttp.connector.TCPConnector(loop=client.loop)
+        yield from client._call('torrent-get', fields=['hashString'], ids='recently-active')
+    client.close()
+    stats = client.rpc_stats.stats()['torrent-get']
+    print('{0:<20} mean {1:>7.2f} ms  p50 {2:>7.2f} ms  p95 {3:>7.2f} ms  max {4:>7.2f} ms'.format(
+        name, stats['mean'], stats['p50'], stats['p95'], stats['max']))
+
+
+def run(host, port, count):
+    loop = asyncio.get_event_loop()
+    for name, reconnect in [('New connection', True), ('Keep-alive', False)]:
+        client = TorrentClient(host=host, port=port, loop=loop)
+        loop.run_until_complete(run_client(name, client, count, reconnect))
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'localhost',
+        int(sys.argv[2]) if len(sys.argv) > 2 else 9091,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 1000)
@@ -0,0 +1,54 @@
+"""
+Measures full, light and recently-active torrent-get calls of the Transmission client against an
+in-process simulated Transmission, so no real daemon is needed. Run from the project root, with a
+settings.py in place, with:
+
+    python3 -m benchmarks.transmission_sync [torrents] [port]
+"""
+import asyncio
+import sys
+import time
+
+from tornado.platform.asyncio import AsyncIOMainLoop
+import tornado.web
+
+from torrents.backends.transmission import TorrentClient
+from torrents.simulator import SimulatedTransmission, RpcHandler
+
+
+@asyncio.coroutine
+def run_client(client, simulator):
+    yield from client.start()
+    for name, call in [
+        ('Full', lambda: client.get_torrents()),
+        ('Light', lambda: client.get_torrents(light=True)),
+        ('Recently active', lambda: client.get_recently_active(light=True)),
+    ]:
+        simulator.tick(1)
+        start = time.time()
+        result = yield from call()
+        if isinstance(result, tuple):
+            result = result[0]
+        print('{0:<20} {1:>8} torrents {2:>10.1f} ms'.format(
+            name, len(result), (time.time() - start) * 1000))
+    client.close()
+
+
+def run(count, port):
+    AsyncIOMainLoop().install()
+    loop = asyncio.get_event_loop()
+    start = time.time()
+    simulator = SimulatedTransmission(torrents=count)
+    print('Created {0} torrents in {1:.1f}s'.format(count, time.time() - start))
+    app = tornado.web.Application([
+        tornado.web.url('/transmission/rpc', RpcHandler,
+                        kwargs={'simulator': simulator, 'latency': 0}),
+    ])
+    app.listen(port)
+    client = TorrentClient(port=port, loop=loop)
+    loop.run_until_complete(run_client(client, simulator))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 19091)
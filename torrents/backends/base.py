@@ -1,7 +1,12 @@
+from collections import deque
+
 from WhatManager3.settings import DEBUG
 
 
 class Torrent(object):
+    __slots__ = ('info_hash', 'path', 'name', 'size_bytes', 'uploaded_bytes', 'done', 'date_added',
+                 'error', 'announces')
+
     def __init__(self, info_hash, path, name, size_bytes, uploaded_bytes, done, date_added, error,
                  announces):
         """
@@ -33,5 +38,95 @@ class Torrent(object):
                 assert len(announces[0][0])
 
 
+class TorrentUpdate(object):
+    """
+    The frequently changing fields of a torrent, returned by clients for light updates. The rest
+    of the fields are kept from the last full record.
+    """
+
+    __slots__ = ('info_hash', 'uploaded_bytes', 'done', 'error')
+    fields = __slots__[1:]
+
+    def __init__(self, info_hash, uploaded_bytes, done, error):
+        self.info_hash = info_hash
+        self.uploaded_bytes = uploaded_bytes
+        self.done = done
+        self.error = error
+
+
+class FieldInterner(object):
+    """
+    Shares equal download paths and announce lists between the Torrent records of a client, so
+    that a full update does not keep one copy of them per torrent. The shared announce lists
+    must not be modified.
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self.announces = {}
+
+    def intern_path(self, path):
+        return self.paths.setdefault(path, path)
+
+    def intern_announces(self, announces):
+        return self.announces.setdefault(tuple(tuple(tier) for tier in announces), announces)
+
+
+class MethodStats(object):
+    __slots__ = ('count', 'errors', 'total', 'max', 'samples')
+
+    def __init__(self, samples):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=samples)
+
+
+class RpcStats(object):
+    """
+    Keeps the number of calls, errors and the latency of every RPC method of a client. The
+    percentiles are computed over the last SAMPLES calls of each method.
+    """
+
+    SAMPLES = 1000
+
+    def __init__(self):
+        self.methods = {}
+
+    def add(self, method, duration, error=False):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats(self.SAMPLES)
+        stats.count += 1
+        stats.errors += error
+        stats.total += duration
+        stats.max = max(stats.max, duration)
+        stats.samples.append(duration)
+
+    def stats(self):
+        """
+        :return: A dict of method to its count, errors and mean, p50, p95 and max latency in ms
+        """
+        result = {}
+        for method, stats in self.methods.items():
+            samples = sorted(stats.samples)
+            result[method] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'mean': stats.total / stats.count * 1000,
+                'p50': samples[len(samples) // 2] * 1000,
+                'p95': samples[len(samples) * 95 // 100] * 1000,
+                'max': stats.max * 1000,
+            }
+        return result
+
+
 class TorrentClientException(Exception):
     pass
+
+
+class TorrentClientConnectionException(TorrentClientException):
+    """
+    The client couldn't be reached or didn't answer, as opposed to rejecting a request.
+    """
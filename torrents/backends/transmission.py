@@ -2,12 +2,15 @@ import asyncio
 import base64
 from datetime import datetime
 import os.path
+import time
 import ujson
 
 import aiohttp
 import pytz
 
-from torrents.backends.base import TorrentClientException, Torrent
+from WhatManager3.json_stream import StreamingArrayParser, JsonStreamException
+from torrents.backends.base import TorrentClientException, TorrentClientConnectionException, \
+    Torrent, TorrentUpdate, FieldInterner, RpcStats
 
 
 class TransmissionException(TorrentClientException):
@@ -15,62 +18,227 @@ class TransmissionException(TorrentClientException):
 
 
 class TorrentClient(object):
+    # Size of the chunks in which torrent-get responses are read and parsed
+    READ_SIZE = 64 * 1024
+    FIELDS = ['id', 'name', 'hashString', 'totalSize', 'uploadedEver', 'percentDone', 'addedDate',
+              'error', 'errorString', 'downloadDir', 'trackers']
+    # Enough to update torrents that are already known, without the large trackers array
+    LIGHT_FIELDS = ['id', 'hashString', 'uploadedEver', 'percentDone', 'error', 'errorString']
+
     def __init__(self, scheme='http', host='localhost', port=9091, path='/transmission/rpc',
-                 username=None, password=None):
+                 username=None, password=None, max_connections=4, timeout=None, loop=None):
+        """
+        :param max_connections: Maximum number of simultaneous RPCs, each of them holding one
+        keep-alive connection from the pool
+        :param timeout: Seconds after which an RPC, including reading the response, fails. None
+        leaves the deadlines to the caller, like ClientManager does.
+        """
         self.session_id = ''
         self.url = '{0}://{1}:{2}{3}'.format(scheme, host, port, path)
         if username or password:
             self.auth = (username, password)
         else:
             self.auth = None
+        self.interner = FieldInterner()
+        # Transmission only reports the ids of removed torrents
+        self.hashes_by_id = {}
+        self.ids_by_hash = {}
+        self.loop = loop or asyncio.get_event_loop()
+        self.connector = aiohttp.connector.TCPConnector(loop=self.loop)
+        self.semaphore = asyncio.Semaphore(max_connections, loop=self.loop)
+        self.timeout = timeout
+        self.rpc_stats = RpcStats()
+
+    @asyncio.coroutine
+    def start(self):
+        """
+        Opens the first connection and retrieves the session id, so the first real RPC doesn't
+        have to go through the 409 round trip.
+        """
+        yield from self._call('session-get')
+
+    def close(self):
+        self.connector.close()
 
+    @asyncio.coroutine
+    def _post(self, body, parser=None):
+        """
+        Posts body, retrying once with the new session id if Transmission rejects the old one.
+        :param parser: A StreamingArrayParser that a successful response is fed to while it's
+        being received, instead of reading it into memory
+        :return: A tuple of the status and the response body, None if it went to the parser
+        """
+        for attempt in range(2):
+            response = yield from aiohttp.request(
+                'POST', self.url, auth=self.auth, data=body, connector=self.connector,
+                loop=self.loop, headers={'X-TRANSMISSION-SESSION-ID': self.session_id})
+            try:
+                if response.status == 200 and parser is not None:
+                    while True:
+                        chunk = yield from response.content.read(self.READ_SIZE)
+                        if not chunk:
+                            return response.status, None
+                        parser.feed(chunk)
+                content = yield from response.read()
+            finally:
+                # Returns the connection to the pool once the response has been read completely,
+                # and closes it if the parser raised or the call was cancelled halfway through
+                response.close()
+            if response.status != 409:
+                break
+            session_id = response.headers['X-TRANSMISSION-SESSION-ID']
+            if self.session_id and session_id != self.session_id:
+                # A new session means Transmission restarted and may have reassigned the ids
+                self._forget_ids()
+            self.session_id = session_id
+        return response.status, content
+
+    @asyncio.coroutine
     def _call(self, method, **arguments):
-        response = yield from aiohttp.request('POST', self.url, auth=self.auth, headers={
-            'X-TRANSMISSION-SESSION-ID': self.session_id
-        }, data=ujson.dumps({
+        return (yield from self._rpc(method, arguments))
+
+    @asyncio.coroutine
+    def _get_torrents(self, callback, **arguments):
+        """
+        Calls torrent-get and passes every torrent in the response to callback as soon as it has
+        been received, so the whole response is never held in memory.
+        :return: The other response arguments, with an empty torrents list
+        """
+        parser = StreamingArrayParser(('arguments', 'torrents'), callback)
+        return (yield from self._rpc('torrent-get', arguments, parser))
+
+    @asyncio.coroutine
+    def _rpc(self, method, arguments, parser=None):
+        body = ujson.dumps({
             'method': method,
             'arguments': arguments,
-        }))
-        if response.status == 409:
-            self.session_id = response.headers['X-TRANSMISSION-SESSION-ID']
-            return (yield from self._call(method, **arguments))
-        body = yield from response.text()
-        if response.status != 200:
-            raise TransmissionException(
-                'Transmission returned {0}: {1}'.format(response.status, body))
-        data = ujson.loads(body)
-        if data['result'] != 'success':
-            raise TransmissionException(data['result'])
-        return data['arguments']
+        }).encode('utf-8')
+        start = time.time()
+        error = True
+        try:
+            with (yield from self.semaphore):
+                post = self._post(body, parser)
+                if self.timeout is not None:
+                    post = asyncio.wait_for(post, self.timeout, loop=self.loop)
+                try:
+                    status, content = yield from post
+                except asyncio.TimeoutError:
+                    raise TorrentClientConnectionException('{0} timed out after {1}s'.format(
+                        method, self.timeout))
+                except (aiohttp.errors.ClientError, aiohttp.errors.DisconnectedError,
+                        aiohttp.errors.HttpProcessingError, OSError) as e:
+                    raise TorrentClientConnectionException('{0} failed: {1}({2})'.format(
+                        method, type(e).__name__, e))
+            if status != 200:
+                raise TorrentClientConnectionException('Transmission returned {0}: {1}'.format(
+                    status, content.decode('utf-8', 'replace')))
+            if parser is not None:
+                try:
+                    data = parser.close()
+                except JsonStreamException as e:
+                    raise TransmissionException(str(e))
+            else:
+                data = ujson.loads(content.decode('utf-8'))
+            if data['result'] != 'success':
+                raise TransmissionException(data['result'])
+            error = False
+            return data['arguments']
+        finally:
+            self.rpc_stats.add(method, time.time() - start, error)
 
-    @asyncio.coroutine
-    def get_torrents(self, hashes=None):
-        args = {
-            'fields': ['name', 'hashString', 'totalSize', 'uploadedEver', 'percentDone',
-                       'addedDate', 'error', 'errorString', 'downloadDir', 'trackers'],
-        }
-        if hashes is not None:
-            args['ids'] = hashes
-        data = yield from self._call('torrent-get', **args)
-        torrents = []
-        for item in data['torrents']:
-            announces = []
-            for tracker in item['trackers']:
-                if tracker['tier'] >= len(announces):
-                    announces.append([])
-                announces[tracker['tier']].append(tracker['announce'])
-            torrents.append(Torrent(
-                item['hashString'].upper(),
-                os.path.dirname(item['downloadDir']),
-                item['name'],
-                item['totalSize'],
+    def _forget_ids(self):
+        self.hashes_by_id = {}
+        self.ids_by_hash = {}
+
+    def _remember_id(self, torrent_id, info_hash):
+        old_hash = self.hashes_by_id.get(torrent_id)
+        if old_hash != info_hash:
+            if old_hash is not None:
+                self.ids_by_hash.pop(old_hash, None)
+            self.hashes_by_id[torrent_id] = info_hash
+            self.ids_by_hash[info_hash] = torrent_id
+
+    def _parse_torrent(self, item, light=False):
+        info_hash = item['hashString'].upper()
+        self._remember_id(item['id'], info_hash)
+        if light:
+            return TorrentUpdate(
+                info_hash,
                 item['uploadedEver'],
                 item['percentDone'],
-                datetime.fromtimestamp(item['addedDate'], tz=pytz.UTC),
                 item['errorString'] if item['error'] else None,
-                announces,
-            ))
-        return torrents
+            )
+        announces = []
+        for tracker in item['trackers']:
+            if tracker['tier'] >= len(announces):
+                announces.append([])
+            announces[tracker['tier']].append(tracker['announce'])
+        return Torrent(
+            info_hash,
+            self.interner.intern_path(os.path.dirname(item['downloadDir'])),
+            item['name'],
+            item['totalSize'],
+            item['uploadedEver'],
+            item['percentDone'],
+            datetime.fromtimestamp(item['addedDate'], tz=pytz.UTC),
+            item['errorString'] if item['error'] else None,
+            self.interner.intern_announces(announces),
+        )
+
+    @asyncio.coroutine
+    def _fetch(self, torrents, light, **arguments):
+        """
+        Gets torrents and appends them to the torrents list as they are parsed.
+        :return: The other response arguments
+        """
+        return (yield from self._get_torrents(
+            lambda item: torrents.append(self._parse_torrent(item, light)),
+            fields=self.LIGHT_FIELDS if light else self.FIELDS, **arguments))
+
+    @asyncio.coroutine
+    def get_torrents(self, hashes=None, light=False):
+        """
+        :param hashes: The info hashes of the torrents to get, None for all torrents
+        :param light: Only get the fields that change while a torrent runs and return
+        TorrentUpdates instead of Torrents
+        """
+        torrents = []
+        if hashes is None:
+            # Transmission assigns new ids when it restarts, so forget the old ones
+            self._forget_ids()
+            yield from self._fetch(torrents, light)
+            return torrents
+        # Torrents with a known id are addressed by it, which is much shorter than the hash
+        by_id = [h for h in hashes if h in self.ids_by_hash]
+        by_hash = [h for h in hashes if h not in self.ids_by_hash]
+        if by_id:
+            yield from self._fetch(torrents, light, ids=[self.ids_by_hash[h] for h in by_id])
+            # The ids may be stale if Transmission restarted, so the torrents that were not
+            # returned under their id are asked for by hash before they're considered gone
+            returned = {t.info_hash for t in torrents}
+            by_hash.extend(h for h in by_id if h not in returned)
+        if by_hash:
+            yield from self._fetch(torrents, light, ids=by_hash)
+        requested = set(hashes)
+        return [t for t in torrents if t.info_hash in requested]
+
+    @asyncio.coroutine
+    def get_recently_active(self, light=False):
+        """
+        :param light: Same as for get_torrents
+        :return: A tuple of the torrents that changed in the last minute and the info hashes of the
+        ones removed since. Removed torrents are only reported if this client has seen their id in
+        an earlier response.
+        """
+        torrents = []
+        data = yield from self._fetch(torrents, light, ids='recently-active')
+        removed_hashes = []
+        for torrent_id in data.get('removed', []):
+            info_hash = self.hashes_by_id.pop(torrent_id, None)
+            if info_hash is not None:
+                self.ids_by_hash.pop(info_hash, None)
+                removed_hashes.append(info_hash)
+        return torrents, removed_hashes
 
     @asyncio.coroutine
     def add_torrent(self, torrent_data, add_path):
@@ -83,8 +251,15 @@ class TorrentClient(object):
 
     @asyncio.coroutine
     def delete_torrent(self, info_hash):
+        yield from self.delete_torrents([info_hash])
+
+    @asyncio.coroutine
+    def delete_torrents(self, info_hashes):
+        """
+        Removes all the torrents and their data with one torrent-remove.
+        """
         args = {
-            'ids': [info_hash],
+            'ids': info_hashes,
             'delete-local-data': True,
         }
         yield from self._call('torrent-remove', **args)
@@ -79,6 +79,171 @@ def bdecode(x):
     return r
 
 
+def skip_int(x, f):
+    n, end = decode_int(x, f)
+    if not x[f + 1 + (n < 0):end - 1].isdigit():
+        raise ValueError()
+    return end
+
+
+def skip_string(x, f):
+    colon = x.index(b':', f)
+    if not x[f:colon].isdigit() or (x[f] == ord('0') and colon != f + 1):
+        raise ValueError()
+    end = colon + 1 + int(x[f:colon])
+    if end > len(x):
+        raise ValueError()
+    return end
+
+
+def decode_key(x, f):
+    # decode_string takes any length int() does, e.g. +1, so keys are validated like values
+    end = skip_string(x, f)
+    return x[x.index(b':', f) + 1:end], end
+
+
+def skip_list(x, f):
+    f += 1
+    while x[f] != ord('e'):
+        f = skip_func[x[f]](x, f)
+    return f + 1
+
+
+def skip_dict(x, f):
+    f, last = f + 1, None
+    while x[f] != ord('e'):
+        k, f = decode_key(x, f)
+        if last is not None and k <= last:
+            raise ValueError()
+        last = k
+        f = skip_func[x[f]](x, f)
+    return f + 1
+
+
+skip_func = {
+    ord('l'): skip_list,
+    ord('d'): skip_dict,
+    ord('i'): skip_int,
+    ord('1'): skip_string,
+    ord('2'): skip_string,
+    ord('0'): skip_string,
+    ord('3'): skip_string,
+    ord('4'): skip_string,
+    ord('5'): skip_string,
+    ord('6'): skip_string,
+    ord('7'): skip_string,
+    ord('8'): skip_string,
+    ord('9'): skip_string,
+}
+
+
+def bdecode_spans(x, keys=None):
+    """
+    Decodes a bencoded dict and records where the raw value of each key starts and ends in x, so
+    that a value (e.g. info) can be hashed without encoding it again. Since hashing the raw bytes
+    is only equivalent to hashing the re-encoded value for canonical input, non-canonical
+    encodings (unsorted or duplicate keys, padded numbers and lengths) are rejected.
+    :param keys: If given, only the values of these keys are decoded. All other values are
+    validated and skipped over without building any objects, but still get a span.
+    :return: a tuple of the decoded dict and a dict of key -> (start, end) offsets in x
+    """
+    try:
+        if x[0] != ord('d'):
+            raise ValueError()
+        r, spans, f, last = {}, {}, 1, None
+        while x[f] != ord('e'):
+            k, f = decode_key(x, f)
+            if last is not None and k <= last:
+                raise ValueError()
+            last = k
+            end = skip_func[x[f]](x, f)
+            if keys is None or k in keys:
+                r[k] = decode_func[x[f]](x, f)[0]
+            spans[k] = (f, end)
+            f = end
+    except (IndexError, KeyError, ValueError):
+        raise BTFailure("not a valid canonical bencoded dict")
+    if f + 1 != len(x):
+        raise BTFailure("invalid bencoded value (data after valid prefix)")
+    return r, spans
+
+
+def decode_string_lazy(x, v, f):
+    colon = x.index(b':', f)
+    n = int(x[f:colon])
+    if x[f] == ord('0') and colon != f + 1:
+        raise ValueError()
+    colon += 1
+    return v[colon:colon + n], colon + n
+
+
+def decode_int_lazy(x, v, f):
+    return decode_int(x, f)
+
+
+def decode_list_lazy(x, v, f):
+    r, f = [], f + 1
+    while x[f] != ord('e'):
+        item, f = decode_lazy_func[x[f]](x, v, f)
+        r.append(item)
+    return r, f + 1
+
+
+def decode_dict_lazy(x, v, f):
+    r, f = {}, f + 1
+    while x[f] != ord('e'):
+        k, f = decode_string(x, f)
+        r[k], f = decode_lazy_func[x[f]](x, v, f)
+    return r, f + 1
+
+
+decode_lazy_func = {
+    ord('l'): decode_list_lazy,
+    ord('d'): decode_dict_lazy,
+    ord('i'): decode_int_lazy,
+    ord('1'): decode_string_lazy,
+    ord('2'): decode_string_lazy,
+    ord('0'): decode_string_lazy,
+    ord('3'): decode_string_lazy,
+    ord('4'): decode_string_lazy,
+    ord('5'): decode_string_lazy,
+    ord('6'): decode_string_lazy,
+    ord('7'): decode_string_lazy,
+    ord('8'): decode_string_lazy,
+    ord('9'): decode_string_lazy,
+}
+
+
+def bdecode_lazy(x):
+    """
+    Decodes x like bdecode, but without copying string values out of it. Strings are returned
+    as memoryview slices of x, which can be compared with bytes directly and are only copied
+    when materialized with bytes() or materialize(). Dict keys are still returned as bytes.
+    :param x: bytes or bytearray - must not be modified while the result is in use
+    """
+    v = memoryview(x)
+    try:
+        r, length = decode_lazy_func[x[0]](x, v, 0)
+    except (IndexError, KeyError, ValueError):
+        raise BTFailure("not a valid bencoded string")
+    if length != len(x):
+        raise BTFailure("invalid bencoded value (data after valid prefix)")
+    return r
+
+
+def materialize(x):
+    """
+    Converts a value returned by bdecode_lazy into the same structure bdecode would return.
+    """
+    if type(x) is memoryview:
+        return x.tobytes()
+    elif type(x) is list:
+        return [materialize(i) for i in x]
+    elif type(x) is dict:
+        return {k: materialize(v) for k, v in x.items()}
+    return x
+
+
 def encode_int(x, r):
     r.extend((b'i', str(x).encode(), b'e'))
 
@@ -114,6 +279,7 @@ def encode_dict(x, r):
 encode_func = {
     int: encode_int,
     bytes: encode_string,
+    memoryview: encode_string,
     list: encode_list,
     tuple: encode_list,
     dict: encode_dict,
@@ -125,3 +291,87 @@ def bencode(x):
     r = []
     encode_func[type(x)](x, r)
     return b''.join(r)
+
+
+class StreamEncoder(object):
+    """
+    Non-recursive bencoder that produces the output as a sequence of chunks instead of joining
+    them, so it can compute the exact encoded size up front and write into a preallocated buffer
+    or a file. Dict keys are sorted once per dict, even when the output is generated more than
+    once. x must not be modified while the encoder is in use.
+    """
+
+    def __init__(self, x):
+        self.x = x
+        self._sorted_keys = {}
+
+    def _items(self, d):
+        keys = self._sorted_keys.get(id(d))
+        if keys is None:
+            keys = self._sorted_keys[id(d)] = sorted(d)
+        for k in keys:
+            yield k
+            yield d[k]
+
+    def chunks(self):
+        stack = [iter((self.x,))]
+        while stack:
+            for item in stack[-1]:
+                t = type(item)
+                if t is bytes or t is memoryview or t is bytearray:
+                    yield '{0}:'.format(len(item)).encode()
+                    yield item
+                elif t is int:
+                    yield 'i{0}e'.format(item).encode()
+                elif t is bool:
+                    yield b'i1e' if item else b'i0e'
+                elif t is list or t is tuple:
+                    yield b'l'
+                    stack.append(iter(item))
+                    break
+                elif t is dict:
+                    yield b'd'
+                    stack.append(self._items(item))
+                    break
+                else:
+                    raise BTFailure('unable to bencode {0}'.format(t.__name__))
+            else:
+                stack.pop()
+                if stack:
+                    yield b'e'
+
+    def size(self):
+        return sum(len(chunk) for chunk in self.chunks())
+
+    def into(self, buf, offset=0):
+        """
+        Writes the encoded value into a writable buffer (e.g. a bytearray of size()).
+        :return: The offset after the last written byte
+        """
+        view = memoryview(buf)
+        for chunk in self.chunks():
+            end = offset + len(chunk)
+            view[offset:end] = chunk
+            offset = end
+        return offset
+
+    def write(self, f, buffer_size=65536):
+        """
+        Writes the encoded value to a file-like object with a write method (for sockets, use
+        socket.makefile('wb')). Small chunks are coalesced into writes of up to buffer_size,
+        large strings are written directly.
+        """
+        pending = bytearray()
+        for chunk in self.chunks():
+            if len(chunk) >= buffer_size:
+                if pending:
+                    f.write(pending)
+                    pending = bytearray()
+                f.write(chunk)
+            else:
+                pending += chunk
+                if len(pending) >= buffer_size:
+                    f.write(pending)
+                    pending = bytearray()
+        if pending:
+            f.write(pending)
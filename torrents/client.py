@@ -39,6 +39,7 @@ def handle_errors(f):
                 response_json.get('error'),
                 response_json.get('traceback')
             )
+        return response_json
 
     return inner
 
@@ -71,3 +72,16 @@ class TorrentManagerClient(object):
             'id': torrent_id
         }
         return requests.post(url, data=data)
+
+    @handle_errors
+    def delete_torrents(self, torrent_ids):
+        """
+        Deletes many torrents at once. The response has a result for every id under 'results',
+        in the format of a delete_torrent response.
+        """
+        url = 'http://{0}:{1}/torrents/delete_many'.format(self.torrent_manager.host,
+                                                           self.torrent_manager.port)
+        data = {
+            'id': list(torrent_ids)
+        }
+        return requests.post(url, data=data)
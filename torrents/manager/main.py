@@ -1,6 +1,10 @@
 import asyncio
+from collections import deque
 from concurrent.futures.thread import ThreadPoolExecutor
+from itertools import chain
 import logging
+import random
+import time
 
 from django.db import transaction
 from django.db.utils import IntegrityError
@@ -8,24 +12,55 @@ from tornado.platform.asyncio import AsyncIOMainLoop
 from tornado.web import Application, url, RequestHandler
 
 from WhatManager3.asyncio_helper import JsonWhatManagerRequestHandler
-from WhatManager3.utils import db_func, prune_connections
+from WhatManager3.utils import db_func, prune_connections, chunks, IN_QUERY_CHUNK_SIZE
+from torrents.backends.base import RpcStats, TorrentClientConnectionException
+from torrents.manager.mirror import InstanceMirror, MirrorRow, columns
 from torrents.manager.sync import compute_sync
-from torrents.manager.utils import Timer
+from torrents.manager.utils import Timer, CircuitBreaker, InstanceUnavailableException, \
+    AdaptiveInterval
 from torrents.models import ClientInstance, ClientTorrent, DownloadLocation, TorrentManager, \
     QueuedTorrent
 from torrents.manager.sharding import choose_shard, TorrentAlreadyAddedException
 from torrents.utils import TorrentInfo
-from trackers.store import TorrentStore
+from trackers.rate_limiter import RateLimiter
+from trackers.store import TorrentStore, AsyncTorrentStore
 
 
 logging.basicConfig(level=logging.INFO)
 
 
 class ClientManager(object):
+    # Seconds between polls of an instance, adapted to its activity within the bounds
     UPDATE_INTERVAL = 3
+    MIN_UPDATE_INTERVAL = 0.5
+    # Must stay below the minute Transmission reports a torrent as recently active for, or the
+    # recently active polls miss changes. The delays are clamped to it, jitter included.
+    MAX_UPDATE_INTERVAL = 30
     FULL_UPDATE_INTERVAL = 30
+    MAX_FULL_UPDATE_INTERVAL = 600
+    # Polls of all instances together may start at most this often per second
+    POLL_BUDGET = 20
+    # Seconds between comparisons of the in-memory torrents of an instance with the database
+    CONSISTENCY_CHECK_INTERVAL = 600
+    # Full updates that can run at once, each holding all torrents of its instance in memory
+    SIMULTANEOUS_FULL_UPDATES = 4
+    # Threads for reading from the database. Writes go through a single thread, so the
+    # instances never contend for database locks.
+    DB_READ_THREADS = 4
+    # Number of torrent-add RPCs that can be in flight to one instance
     SIMULTANEOUS_ADDS = 2
+    # Seconds to wait for more adds to sync together after a torrent was added
+    ADDED_SYNC_DELAY = 0.5
     QUEUE_POP_INTERVAL = 5
+    # Poll only the torrents Transmission reports as recently active instead of all unfinished
+    # ones. Seeding torrents then get their upload counters updated every UPDATE_INTERVAL too.
+    RECENTLY_ACTIVE_UPDATES = True
+    # Seconds an RPC to an instance may take before it fails, longer for fetching all torrents
+    RPC_TIMEOUT = 30
+    FULL_UPDATE_RPC_TIMEOUT = 300
+    # Consecutive failed RPCs after which an instance is skipped, and seconds until it's probed
+    BREAKER_FAILURES = 3
+    BREAKER_RESET_TIMEOUT = 30
 
     @db_func
     def __init__(self, torrent_manager, event_loop=None):
@@ -37,53 +72,164 @@ class ClientManager(object):
         }
         for instance in self.instances.values():
             instance.lock = asyncio.Lock(loop=self.loop)
-        self.update_pool = ThreadPoolExecutor(1)
-        self.pool = ThreadPoolExecutor(2)
+            instance.add_semaphore = asyncio.Semaphore(self.SIMULTANEOUS_ADDS, loop=self.loop)
+            # Adds that chose the instance and haven't finished their torrent-add yet
+            instance.reserved_adds = 0
+            # (future, info hashes) of the torrents added since the last post-add sync
+            instance.added_sync = None
+            instance.mirror = InstanceMirror()
+            instance.breaker = CircuitBreaker(self.BREAKER_FAILURES, self.BREAKER_RESET_TIMEOUT)
+            instance.update_interval = AdaptiveInterval(
+                self.UPDATE_INTERVAL, self.MIN_UPDATE_INTERVAL, self.MAX_UPDATE_INTERVAL)
+            instance.full_update_interval = AdaptiveInterval(
+                self.FULL_UPDATE_INTERVAL, self.FULL_UPDATE_INTERVAL,
+                self.MAX_FULL_UPDATE_INTERVAL)
+        self.read_pool = ThreadPoolExecutor(self.DB_READ_THREADS)
+        self.write_pool = ThreadPoolExecutor(1)
+        self.full_update_semaphore = asyncio.Semaphore(self.SIMULTANEOUS_FULL_UPDATES,
+                                                       loop=self.loop)
         self.update_index = 0
+        self.download_locations = []
         self.info_hashes = set()
-        self.torrent_store = TorrentStore.create()
+        self.adding_info_hashes = set()
+        self.adding_condition = asyncio.Condition(loop=self.loop)
+        self.shard_lock = asyncio.Lock(loop=self.loop)
+        self.add_stats = RpcStats()
+        self.added_times = deque(maxlen=10000)
+        self.poll_budget = RateLimiter(self.POLL_BUDGET, 1)
+        self.torrent_store = AsyncTorrentStore(TorrentStore.create(), self.loop)
 
     @asyncio.coroutine
     def start(self):
-        yield from self.full_update_loop()
-        for instance in self.instances.values():
-            asyncio.async(self.update_loop(instance), loop=self.loop)
+        instances = list(self.instances.values())
+        results = yield from asyncio.gather(
+            *[self.call_client(instance, instance.client.start()) for instance in instances],
+            loop=self.loop, return_exceptions=True)
+        for instance, result in zip(instances, results):
+            if isinstance(result, Exception):
+                self.logger.error('Starting {0} failed: {1}'.format(instance, result))
+        yield from asyncio.gather(
+            *[self.load_mirror(instance) for instance in instances], loop=self.loop)
+        yield from asyncio.gather(
+            *[self.full_update(instance) for instance in instances], loop=self.loop)
+        # Spread the first polls so the instances don't start out in lockstep
+        for instance in instances:
+            self.loop.call_later(random.uniform(0, self.UPDATE_INTERVAL), asyncio.async,
+                                 self.update_loop(instance))
+            self.loop.call_later(random.uniform(0, self.FULL_UPDATE_INTERVAL), asyncio.async,
+                                 self.full_update_loop(instance))
+            self.loop.call_later(
+                random.uniform(0.5, 1.5) * self.CONSISTENCY_CHECK_INTERVAL, asyncio.async,
+                self.consistency_check_loop(instance))
         asyncio.async(self.queue_loop(), loop=self.loop)
 
     @asyncio.coroutine
-    @db_func
-    def queue_pop(self):
+    def call_client(self, instance, coro, timeout=None):
+        """
+        Runs an RPC to instance with a deadline, through the circuit breaker of the instance. Only
+        failing to reach the instance counts against the breaker, errors it answers with don't.
+        :param coro: The client coroutine making the RPC
+        :param timeout: Seconds after which the call fails, RPC_TIMEOUT if None
+        """
+        if not instance.breaker.allow():
+            coro.close()
+            raise InstanceUnavailableException('{0} is unavailable after {1} failures'.format(
+                instance, instance.breaker.failures))
         try:
-            top = QueuedTorrent.top()
-        except QueuedTorrent.DoesNotExist:
-            return
-        torrent_data = self.torrent_store.get(top.announces_hash, top.info_hash)
+            result = yield from asyncio.wait_for(
+                coro, timeout or self.RPC_TIMEOUT, loop=self.loop)
+        except (TorrentClientConnectionException, OSError, asyncio.TimeoutError) as e:
+            was_tripped = instance.breaker.tripped
+            instance.breaker.failure()
+            if instance.breaker.tripped and not was_tripped:
+                self.logger.error('{0} failed {1} times, last with {2}, skipping it'.format(
+                    instance, instance.breaker.failures, type(e).__name__))
+            raise
+        except Exception:
+            self.breaker_success(instance)
+            raise
+        self.breaker_success(instance)
+        return result
+
+    def breaker_success(self, instance):
+        if instance.breaker.tripped:
+            self.logger.info('{0} is available again'.format(instance))
+        instance.breaker.success()
+
+    @asyncio.coroutine
+    def add_queued(self, queued):
+        torrent_data = yield from self.torrent_store.get(queued.announces_hash, queued.info_hash)
         try:
-            yield from self.add_torrent(torrent_data, top.path)
+            yield from self.add_torrent(torrent_data, queued.path)
         except TorrentAlreadyAddedException:
-            self.logger.info('Popped already added torrent {0}'.format(top.info_hash))
+            self.logger.info('Popped already added torrent {0}'.format(queued.info_hash))
         prune_connections()
-        top.delete()
+        queued.delete()
+
+    @asyncio.coroutine
+    @db_func
+    def queue_pop(self):
+        """
+        Adds as many torrents from the head of the queue at once as the add windows of all
+        instances allow.
+        :return: Whether a full batch was added without errors, so the next one can start
+        right away
+        """
+        batch_size = self.SIMULTANEOUS_ADDS * len(self.instances)
+        queued = QueuedTorrent.head(batch_size)
+        results = yield from asyncio.gather(
+            *[self.add_queued(q) for q in queued], loop=self.loop, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors:
+            self.logger.error('Adding queued torrent failed: {0}'.format(error))
+        return len(queued) == batch_size and not errors
 
     @asyncio.coroutine
     def queue_loop(self):
+        delay = self.QUEUE_POP_INTERVAL
         try:
-            yield from self.queue_pop()
+            if (yield from self.queue_pop()):
+                delay = 0
         finally:
-            self.loop.call_later(self.QUEUE_POP_INTERVAL, asyncio.async, self.queue_loop())
+            self.loop.call_later(delay, asyncio.async, self.queue_loop())
 
     @db_func
-    def get_torrents(self, query):
+    def get_torrents(self, instance):
+        """
+        :return: A dict of info_hash to the MirrorRows of instance and the DownloadLocations
+        """
         with Timer(self.logger, 'Pull torrents from DB') as t:
-            torrents = {
-                t['info_hash']: t for t in query
-            }
+            query = ClientTorrent.objects.filter(instance=instance).values_list(*columns)
+            rows = (MirrorRow(*fields) for fields in query.iterator())
+            torrents = {row.info_hash: row for row in rows}
             download_locations = list(DownloadLocation.objects.all())
             t.op += ' fetched {0}'.format(len(torrents))
             return torrents, download_locations
 
     @db_func
-    def update_db(self, new_torrents, changed_torrents, deleted_hashes):
+    def get_download_locations(self):
+        return list(DownloadLocation.objects.all())
+
+    @asyncio.coroutine
+    def load_mirror(self, instance):
+        """
+        Loads the in-memory copy of the rows of instance, which the syncs then diff against.
+        """
+        m_torrents, self.download_locations = yield from self.loop.run_in_executor(
+            self.read_pool, self.get_torrents, instance)
+        instance.mirror.load(m_torrents.values())
+
+    @asyncio.coroutine
+    def ensure_mirror(self, instance):
+        if not instance.mirror.loaded:
+            self.logger.info('Reloading torrents of {0} from DB'.format(instance))
+            yield from self.load_mirror(instance)
+
+    @db_func
+    def update_db(self, instance, new_torrents, changed_torrents, deleted_hashes):
+        """
+        :return: The MirrorRows of the new rows, read back because bulk_create doesn't set the ids
+        """
         try:
             with transaction.atomic():
                 ClientTorrent.objects.bulk_create(new_torrents)
@@ -106,96 +252,283 @@ class ClientManager(object):
             for torrent in changed_torrents:
                 torrent.save()
         with transaction.atomic():
-            ClientTorrent.objects.filter(info_hash__in=deleted_hashes).delete()
+            for chunk in chunks(deleted_hashes, IN_QUERY_CHUNK_SIZE):
+                ClientTorrent.objects.filter(instance=instance, info_hash__in=chunk).delete()
+        return [MirrorRow(*fields) for fields in chain.from_iterable(
+            ClientTorrent.objects.filter(instance=instance, info_hash__in=chunk).values_list(
+                *columns)
+            for chunk in chunks([t.info_hash for t in new_torrents], IN_QUERY_CHUNK_SIZE))]
 
     @asyncio.coroutine
-    def apply_sync(self, pool, instance, download_locations, m_torrents, t_torrents):
-        change_set = compute_sync(instance, download_locations, m_torrents, t_torrents)
+    def apply_sync(self, instance, m_torrents, t_torrents):
+        """
+        Writes the differences between the rows in m_torrents and the torrents from the client
+        and applies them to the mirror of the instance.
+        :return: The number of torrents created, changed and deleted
+        """
+        # The diff of a full update takes long enough to hold up the responses of other
+        # instances that are being streamed in. The mirror it reads is only changed under the
+        # instance lock, which the caller holds.
+        change_set = yield from self.loop.run_in_executor(
+            self.read_pool, compute_sync, instance, self.download_locations, m_torrents,
+            t_torrents)
         self.logger.info('{0} sync is {1} new, {2} changed, {3} deleted'.format(
             instance, len(change_set[0]), len(change_set[1]), len(change_set[2])
         ))
-        yield from self.loop.run_in_executor(pool, self.update_db, *change_set)
+        try:
+            new_rows = yield from self.loop.run_in_executor(
+                self.write_pool, self.update_db, instance, *change_set)
+        except Exception:
+            # Part of the changes may have been written
+            instance.mirror.loaded = False
+            raise
+        instance.mirror.apply(new_rows, change_set[1], change_set[2])
+        return sum(len(changes) for changes in change_set)
 
     @asyncio.coroutine
     def update(self, instance):
         with Timer(self.logger, 'Full update {0}'.format(instance)):
-            query = ClientTorrent.objects.filter(instance=instance).values()
-            m_task = self.loop.run_in_executor(self.update_pool, self.get_torrents, query)
+            yield from self.ensure_mirror(instance)
+            # Once per full cycle, so locations added since the mirror was loaded are picked up
+            self.download_locations = yield from self.loop.run_in_executor(
+                self.read_pool, self.get_download_locations)
             with Timer(self.logger, 'Pull torrents from Transmission'):
                 t_torrents = {
                     t.info_hash: t for t in
-                    (yield from instance.client.get_torrents())
+                    (yield from self.call_client(instance, instance.client.get_torrents(),
+                                                 self.FULL_UPDATE_RPC_TIMEOUT))
                 }
-            m_torrents, download_locations = yield from m_task
-            yield from self.apply_sync(self.update_pool, instance, download_locations,
-                                       m_torrents, t_torrents)
+            return (yield from self.apply_sync(instance, instance.mirror.torrents, t_torrents))
 
     @asyncio.coroutine
     def update_partial(self, instance):
+        """
+        :return: The number of changes and of unfinished torrents
+        """
         with Timer(self.logger, 'Partial update {0}'.format(instance)):
-            query = ClientTorrent.objects.filter(instance=instance, done__lt=1).values()
-            m_torrents, download_locations = yield from self.loop.run_in_executor(
-                self.update_pool, self.get_torrents, query)
+            yield from self.ensure_mirror(instance)
+            m_torrents = instance.mirror.select(instance.mirror.downloading)
             t_torrents = {
                 t.info_hash: t for t in
-                (yield from instance.client.get_torrents(list(m_torrents)))
+                (yield from self.call_client(
+                    instance, instance.client.get_torrents(list(m_torrents), light=True)))
             }
-            yield from self.apply_sync(self.update_pool, instance, download_locations,
-                                       m_torrents, t_torrents)
+            changes = yield from self.apply_sync(instance, m_torrents, t_torrents)
+            return changes, sum(1 for t in t_torrents.values() if t.done < 1)
+
+    @asyncio.coroutine
+    def update_recent(self, instance):
+        """
+        Syncs only the torrents that Transmission reports as changed or removed since the last
+        poll, so the update costs the same no matter how many torrents the instance has.
+        :return: The number of changes and of unfinished torrents, like update_partial
+        """
+        with Timer(self.logger, 'Recently active update {0}'.format(instance)):
+            yield from self.ensure_mirror(instance)
+            torrents, removed_hashes = yield from self.call_client(
+                instance, instance.client.get_recently_active(light=True))
+            t_torrents = {t.info_hash: t for t in torrents}
+            hashes = list(t_torrents) + [h for h in removed_hashes if h not in t_torrents]
+            if not hashes:
+                return 0, 0
+            m_torrents = instance.mirror.select(hashes)
+            # Light records can only update known torrents, new ones need their full record
+            unknown_hashes = [h for h in t_torrents if h not in m_torrents]
+            if unknown_hashes:
+                for torrent in (yield from self.call_client(
+                        instance, instance.client.get_torrents(unknown_hashes))):
+                    t_torrents[torrent.info_hash] = torrent
+            changes = yield from self.apply_sync(instance, m_torrents, t_torrents)
+            return changes, sum(1 for t in t_torrents.values() if t.done < 1)
 
     @asyncio.coroutine
     def update_loop(self, instance):
         try:
+            yield from self.poll_budget.wait_operation()
             with (yield from instance.lock):
-                yield from self.update_partial(instance)
+                # Waiting for the lock says nothing about how fast the instance answers
+                start = time.time()
+                if self.RECENTLY_ACTIVE_UPDATES:
+                    changes, downloading = yield from self.update_recent(instance)
+                else:
+                    changes, downloading = yield from self.update_partial(instance)
+            instance.update_interval.record(changes, downloading, time.time() - start)
+        except InstanceUnavailableException:
+            pass
         except Exception:
-            raise
+            self.logger.exception('Update of {0} failed'.format(instance))
         finally:
-            self.loop.call_later(self.UPDATE_INTERVAL, asyncio.async, self.update_loop(instance))
+            self.loop.call_later(instance.update_interval.delay(), asyncio.async,
+                                 self.update_loop(instance))
 
     @asyncio.coroutine
-    def full_update_loop(self):
-        for instance in self.instances.values():
-            try:
+    def full_update(self, instance):
+        """
+        Runs a full update of instance once fewer than SIMULTANEOUS_FULL_UPDATES are running, so
+        the instances are updated in parallel without all their torrents being in memory at once.
+        :return: The number of changes, None if the update failed
+        """
+        try:
+            with (yield from self.full_update_semaphore):
                 with (yield from instance.lock):
-                    yield from self.update(instance)
-            except Exception:
-                raise
-        self.loop.call_later(self.FULL_UPDATE_INTERVAL, asyncio.async, self.full_update_loop())
+                    start = time.time()
+                    changes = yield from self.update(instance)
+                    instance.full_update_interval.record(changes, 0, time.time() - start)
+                    return changes
+        except InstanceUnavailableException:
+            pass
+        except Exception:
+            self.logger.exception('Full update of {0} failed'.format(instance))
 
     @asyncio.coroutine
-    def update_added_torrent(self, instance, info_hash):
-        with Timer(self.logger, 'Update added torrent {0}'.format(info_hash)):
-            query = ClientTorrent.objects.filter(instance=instance, info_hash=info_hash)
-            m_torrents, download_locations = yield from self.loop.run_in_executor(
-                self.pool, self.get_torrents, query)
-            t_torrents = {
-                t.info_hash: t for t in
-                (yield from instance.client.get_torrents([info_hash]))
-            }
-            yield from self.apply_sync(self.pool, instance, download_locations,
-                                       m_torrents, t_torrents)
+    def full_update_loop(self, instance):
+        """
+        Full updates catch what the partial ones missed, so they slow down as long as they
+        don't find any changes.
+        """
+        try:
+            yield from self.poll_budget.wait_operation()
+            yield from self.full_update(instance)
+        finally:
+            self.loop.call_later(instance.full_update_interval.delay(), asyncio.async,
+                                 self.full_update_loop(instance))
+
+    @asyncio.coroutine
+    def consistency_check(self, instance):
+        """
+        Compares the mirror of instance with its rows in the database, which differ only if
+        something else wrote to them, and replaces it with them.
+        """
+        with (yield from instance.lock):
+            with Timer(self.logger, 'Consistency check {0}'.format(instance)):
+                m_torrents, self.download_locations = yield from self.loop.run_in_executor(
+                    self.read_pool, self.get_torrents, instance)
+                differences = instance.mirror.count_differences(m_torrents)
+                if differences:
+                    self.logger.warning('{0} torrents of {1} differed from DB'.format(
+                        differences, instance))
+                instance.mirror.load(m_torrents.values())
+
+    @asyncio.coroutine
+    def consistency_check_loop(self, instance):
+        try:
+            yield from self.consistency_check(instance)
+        except Exception:
+            self.logger.exception('Consistency check of {0} failed'.format(instance))
+        finally:
+            self.loop.call_later(self.CONSISTENCY_CHECK_INTERVAL, asyncio.async,
+                                 self.consistency_check_loop(instance))
+
+    @asyncio.coroutine
+    def update_added_torrents(self, instance):
+        """
+        Syncs all torrents added to the instance since the last call with one torrent-get.
+        """
+        future, info_hashes = instance.added_sync
+        instance.added_sync = None
+        start = time.time()
+        try:
+            with (yield from instance.lock):
+                with Timer(self.logger, 'Update {0} added torrents'.format(len(info_hashes))):
+                    yield from self.ensure_mirror(instance)
+                    # Torrents may be added to new download locations
+                    self.download_locations = yield from self.loop.run_in_executor(
+                        self.read_pool, self.get_download_locations)
+                    t_torrents = {
+                        t.info_hash: t for t in
+                        (yield from self.call_client(
+                            instance, instance.client.get_torrents(info_hashes)))
+                    }
+                    yield from self.apply_sync(instance, instance.mirror.select(info_hashes),
+                                               t_torrents)
+                # The added torrents are downloading, so they're followed as closely as possible
+                instance.update_interval.reset()
+        except Exception as e:
+            self.add_stats.add('sync', time.time() - start, True)
+            future.set_exception(e)
+        else:
+            self.add_stats.add('sync', time.time() - start)
+            future.set_result(None)
+
+    @asyncio.coroutine
+    def sync_added_torrent(self, instance, info_hash):
+        """
+        Waits until info_hash is synced to the database. Torrents added to the same instance
+        within ADDED_SYNC_DELAY are synced together.
+        """
+        if instance.added_sync is None:
+            instance.added_sync = (asyncio.Future(loop=self.loop), [])
+            self.loop.call_later(self.ADDED_SYNC_DELAY, asyncio.async,
+                                 self.update_added_torrents(instance))
+        future, info_hashes = instance.added_sync
+        info_hashes.append(info_hash)
+        yield from asyncio.shield(future, loop=self.loop)
 
     @asyncio.coroutine
     def add_torrent(self, torrent_data, add_path):
-        info = TorrentInfo.from_binary(torrent_data)
+        info = TorrentInfo.from_binary_cached(torrent_data)
         hashes_key = (info.announces_hash, info.info_hash)
         if hashes_key in self.info_hashes:
             raise TorrentAlreadyAddedException()
         self.info_hashes.add(hashes_key)
+        start = time.time()
+        error = True
         try:
-            locked_instances = [i for i in self.instances.values() if not i.lock.locked()]
+            # Adds of the same info_hash with other announces must go to other instances, which
+            # choose_shard only knows once the first one is synced, so they run one at a time
+            with (yield from self.adding_condition):
+                yield from self.adding_condition.wait_for(
+                    lambda: info.info_hash not in self.adding_info_hashes)
+                self.adding_info_hashes.add(info.info_hash)
+            try:
+                yield from self._add_torrent(info, torrent_data, add_path)
+            finally:
+                with (yield from self.adding_condition):
+                    self.adding_info_hashes.remove(info.info_hash)
+                    self.adding_condition.notify_all()
+            error = False
+        finally:
+            self.info_hashes.remove(hashes_key)
+            self.add_stats.add('add', time.time() - start, error)
+            if not error:
+                self.added_times.append(time.time())
+
+    @asyncio.coroutine
+    def _add_torrent(self, info, torrent_data, add_path):
+        # Adds choose one at a time and reserve a place in the add window of the instance right
+        # away, so a burst of adds sees the earlier choices and spreads over the instances.
+        # Instances whose add window is full are only chosen if no other one fits.
+        with (yield from self.shard_lock):
+            busy_instances = [i for i in self.instances.values()
+                              if i.reserved_adds >= self.SIMULTANEOUS_ADDS]
+            tripped_instances = [i for i in self.instances.values() if i.breaker.tripped]
             shard_id = yield from self.loop.run_in_executor(
-                self.pool, choose_shard, locked_instances, info.announces_hash, info.info_hash)
+                self.read_pool, choose_shard, busy_instances, info.announces_hash,
+                info.info_hash, tripped_instances)
             instance = self.instances[shard_id]
-            with (yield from instance.lock):
+            instance.reserved_adds += 1
+        try:
+            with (yield from instance.add_semaphore):
                 self.logger.info('Adding torrent {0} to instance {1}'.format(
                     info.info_hash, instance
                 ))
-                yield from instance.client.add_torrent(torrent_data, add_path)
-                yield from self.update_added_torrent(instance, info.info_hash)
+                yield from self.call_client(
+                    instance, instance.client.add_torrent(torrent_data, add_path))
         finally:
-            self.info_hashes.remove(hashes_key)
+            instance.reserved_adds -= 1
+        yield from self.sync_added_torrent(instance, info.info_hash)
+
+    def get_add_stats(self):
+        """
+        :return: The latency of adds and of the syncs after them, the number of adds in progress
+        and the adds per minute over the last minute
+        """
+        minute_ago = time.time() - 60
+        return {
+            'latency': self.add_stats.stats(),
+            'in_progress': len(self.info_hashes),
+            'per_minute': sum(1 for t in self.added_times if t > minute_ago),
+        }
 
     @asyncio.coroutine
     @db_func
@@ -215,13 +548,100 @@ class ClientManager(object):
                 ClientTorrent.objects.get(id=torrent_id)
             except ClientTorrent.DoesNotExist:
                 return not_found_resp
-            yield from instance.client.delete_torrent(torrent.info_hash)
+            yield from self.call_client(instance, instance.client.delete_torrent(torrent.info_hash))
             prune_connections()
             torrent.delete()
+            instance.mirror.remove(torrent.info_hash)
             return {
                 'success': True
             }
 
+    @db_func
+    def get_instance_hashes_by_id(self, instance, torrent_ids):
+        """
+        :return: A dict of torrent id to info hash for the torrent_ids that belong to instance
+        """
+        return dict(chain.from_iterable(
+            ClientTorrent.objects.filter(instance=instance, id__in=chunk)
+            .values_list('id', 'info_hash')
+            for chunk in chunks(torrent_ids, IN_QUERY_CHUNK_SIZE)
+        ))
+
+    @db_func
+    def get_ids_by_instance(self, torrent_ids):
+        """
+        :return: A dict of instance id to the torrent_ids on that instance, leaving out unknown ids
+        """
+        ids_by_instance = {}
+        for chunk in chunks(torrent_ids, IN_QUERY_CHUNK_SIZE):
+            query = ClientTorrent.objects.filter(id__in=chunk).values_list('id', 'instance_id')
+            for torrent_id, instance_id in query:
+                ids_by_instance.setdefault(instance_id, []).append(torrent_id)
+        return ids_by_instance
+
+    @db_func
+    def delete_rows(self, torrent_ids):
+        with transaction.atomic():
+            for chunk in chunks(torrent_ids, IN_QUERY_CHUNK_SIZE):
+                ClientTorrent.objects.filter(id__in=chunk).delete()
+
+    @asyncio.coroutine
+    def delete_instance_torrents(self, instance, torrent_ids):
+        """
+        Deletes torrents of one instance with a single torrent-remove.
+        :return: The ids of the torrents that were deleted
+        """
+        with (yield from instance.lock):
+            # Some of them may have been removed while waiting for the lock
+            hashes_by_id = yield from self.loop.run_in_executor(
+                self.read_pool, self.get_instance_hashes_by_id, instance, torrent_ids)
+            if not hashes_by_id:
+                return []
+            yield from self.call_client(
+                instance, instance.client.delete_torrents(list(hashes_by_id.values())))
+            yield from self.loop.run_in_executor(
+                self.write_pool, self.delete_rows, list(hashes_by_id.keys()))
+            for info_hash in hashes_by_id.values():
+                instance.mirror.remove(info_hash)
+            return list(hashes_by_id.keys())
+
+    @asyncio.coroutine
+    def delete_torrents(self, torrent_ids):
+        """
+        Deletes many torrents, sending one torrent-remove to each instance that has some of them.
+        :return: A dict of torrent id to the result of deleting it, in the format of delete_torrent
+        """
+        ids_by_instance = yield from self.loop.run_in_executor(
+            self.read_pool, self.get_ids_by_instance, torrent_ids)
+        results = {
+            torrent_id: {
+                'success': False,
+                'error_code': 'torrent_not_found',
+                'error': 'Torrent was not found',
+            } for torrent_id in torrent_ids
+        }
+        instances = [self.instances[instance_id] for instance_id in ids_by_instance]
+        instance_results = yield from asyncio.gather(
+            *[self.delete_instance_torrents(instance, ids_by_instance[instance.id])
+              for instance in instances], loop=self.loop, return_exceptions=True)
+        for instance, deleted_ids in zip(instances, instance_results):
+            if isinstance(deleted_ids, Exception):
+                self.logger.error('Deleting torrents from {0} failed: {1}'.format(
+                    instance, deleted_ids))
+                error = {
+                    'success': False,
+                    'error_code': 'client_error',
+                    'error': '{0}({1})'.format(type(deleted_ids).__name__, str(deleted_ids)),
+                }
+                for torrent_id in ids_by_instance[instance.id]:
+                    results[torrent_id] = error
+                continue
+            for torrent_id in deleted_ids:
+                results[torrent_id] = {
+                    'success': True
+                }
+        return results
+
 
 class AddTorrentHandler(JsonWhatManagerRequestHandler):
     def __init__(self, *args, **kwargs):
@@ -275,6 +695,60 @@ class DeleteTorrentHandler(JsonWhatManagerRequestHandler):
             }
 
 
+class DeleteManyTorrentsHandler(JsonWhatManagerRequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.updater = kwargs.pop('updater')
+        super(DeleteManyTorrentsHandler, self).__init__(*args, **kwargs)
+
+    @asyncio.coroutine
+    def post_json(self):
+        try:
+            torrent_ids = [int(i) for i in self.get_body_arguments('id')]
+        except ValueError:
+            torrent_ids = None
+        if not torrent_ids:
+            return {
+                'success': False,
+                'error_code': 'missing_parameter',
+                'error': 'Please send one or more numeric id parameters in POST.',
+            }
+        return {
+            'success': True,
+            'results': (yield from self.updater.delete_torrents(torrent_ids)),
+        }
+
+
+class StatsHandler(JsonWhatManagerRequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.updater = kwargs.pop('updater')
+        super(StatsHandler, self).__init__(*args, **kwargs)
+
+    @asyncio.coroutine
+    def get_json(self):
+        return {
+            'success': True,
+            'rpc': {
+                instance.id: instance.client.rpc_stats.stats()
+                for instance in self.updater.instances.values()
+            },
+            'adds': self.updater.get_add_stats(),
+            'intervals': {
+                instance.id: {
+                    'update': instance.update_interval.interval,
+                    'full_update': instance.full_update_interval.interval,
+                }
+                for instance in self.updater.instances.values()
+            },
+            'breakers': {
+                instance.id: {
+                    'state': instance.breaker.state,
+                    'failures': instance.breaker.failures,
+                }
+                for instance in self.updater.instances.values()
+            },
+        }
+
+
 class PingHandler(RequestHandler):
     def get(self):
         self.write('OK')
@@ -295,6 +769,8 @@ def run():
     app = Application([
         url('/torrents/add', AddTorrentHandler, kwargs={'updater': updater}),
         url('/torrents/delete', DeleteTorrentHandler, kwargs={'updater': updater}),
+        url('/torrents/delete_many', DeleteManyTorrentsHandler, kwargs={'updater': updater}),
+        url('/stats', StatsHandler, kwargs={'updater': updater}),
         url('/ping', PingHandler),
     ])
     app.listen(torrent_manager.port)
@@ -0,0 +1,121 @@
+from operator import attrgetter
+
+from torrents.models import ClientTorrent
+
+
+# The columns of the ClientTorrent rows, in the order of values_list(*columns)
+columns = [f.attname for f in ClientTorrent._meta.concrete_fields]
+row_fields = attrgetter(*columns)
+# Columns whose values repeat between rows, so the rows share one object per value
+interned_columns = ['instance_id', 'location_id', 'announces_enc']
+
+
+class MirrorRow(object):
+    """
+    A ClientTorrent row. The columns are slots instead of a values() dict, which keeps a mirror of
+    hundreds of thousands of rows several times smaller.
+    """
+
+    __slots__ = columns
+
+    def __init__(self, *fields):
+        """
+        :param fields: The values of the columns, in the order of columns
+        """
+        for column, value in zip(columns, fields):
+            setattr(self, column, value)
+
+    @classmethod
+    def from_client_torrent(cls, torrent):
+        return cls(*row_fields(torrent))
+
+    def values(self):
+        """
+        :return: A dict of column to value, the way values() returns the row
+        """
+        return dict(zip(columns, row_fields(self)))
+
+    def __eq__(self, other):
+        return type(other) is MirrorRow and row_fields(self) == row_fields(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'MirrorRow({0!r})'.format(self.values())
+
+
+class InstanceMirror(object):
+    """
+    The ClientTorrent rows of one instance, as MirrorRows by info_hash. The manager is the only
+    writer of these rows, so they are loaded once and then kept current by applying the manager's
+    own changes, instead of being read back from the database before every sync.
+    """
+
+    def __init__(self):
+        self.torrents = {}
+        self.hashes_by_id = {}
+        # Info hashes of the unfinished torrents, the ones partial updates look at
+        self.downloading = set()
+        # Column to the dict that shares its equal values between the rows
+        self.interned = {column: {} for column in interned_columns}
+        # Cleared when a write may not have been applied completely, to reload before using it
+        self.loaded = False
+
+    def load(self, rows):
+        self.torrents = {}
+        self.hashes_by_id = {}
+        self.downloading = set()
+        self.interned = {column: {} for column in interned_columns}
+        for row in rows:
+            self._put(row)
+        self.loaded = True
+
+    def _put(self, row):
+        info_hash = row.info_hash
+        for column, interned in self.interned.items():
+            value = getattr(row, column)
+            setattr(row, column, interned.setdefault(value, value))
+        old_row = self.torrents.get(info_hash)
+        if old_row is not None and old_row.id != row.id:
+            del self.hashes_by_id[old_row.id]
+        self.torrents[info_hash] = row
+        self.hashes_by_id[row.id] = info_hash
+        if row.done < 1:
+            self.downloading.add(info_hash)
+        else:
+            self.downloading.discard(info_hash)
+
+    def remove(self, info_hash):
+        row = self.torrents.pop(info_hash, None)
+        if row is not None:
+            del self.hashes_by_id[row.id]
+            self.downloading.discard(info_hash)
+
+    def apply(self, new_rows, changed_torrents, deleted_hashes):
+        """
+        Applies the changes of a sync once they have been written.
+        :param new_rows: The MirrorRows of the created rows, read back for their ids
+        :param changed_torrents: The updated ClientTorrents
+        :param deleted_hashes: The info hashes of the deleted rows
+        """
+        for row in new_rows:
+            self._put(row)
+        for torrent in changed_torrents:
+            self._put(MirrorRow.from_client_torrent(torrent))
+        for info_hash in deleted_hashes:
+            self.remove(info_hash)
+
+    def select(self, info_hashes):
+        """
+        :return: A dict of info_hash to MirrorRow for the info hashes that have a row
+        """
+        return {h: self.torrents[h] for h in info_hashes if h in self.torrents}
+
+    def count_differences(self, rows):
+        """
+        :param rows: A dict of info_hash to MirrorRow, as read from the database
+        :return: The number of rows that are missing, extra or different in the mirror
+        """
+        differences = sum(1 for h, row in rows.items() if self.torrents.get(h) != row)
+        return differences + sum(1 for h in self.torrents if h not in rows)
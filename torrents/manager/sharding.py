@@ -9,8 +9,14 @@ class TorrentAlreadyAddedException(Exception):
 
 
 @db_func
-def choose_shard(locked_instances, announces_hash, info_hash):
+def choose_shard(locked_instances, announces_hash, info_hash, tripped_instances=()):
+    """
+    :param locked_instances: Instances that are only chosen if no other one fits
+    :param tripped_instances: Instances that are never chosen, because they are failing
+    :return: The id of the instance to add the torrent to
+    """
     locked_ids = {i.id for i in locked_instances}
+    tripped_ids = {i.id for i in tripped_instances}
     torrents = list(ClientTorrent.objects.filter(info_hash=info_hash))
     existing = [t for t in torrents if t.announces_hash == announces_hash]
     if len(existing):
@@ -18,12 +24,15 @@ def choose_shard(locked_instances, announces_hash, info_hash):
             existing[0].instance
         ))
     avoid_ids = {t.instance_id for t in torrents}
-    instances = ClientInstance.objects.exclude(id__in=avoid_ids).extra(select={
+    instances = ClientInstance.objects.exclude(id__in=avoid_ids | tripped_ids).extra(select={
         'torrent_count': 'SELECT COUNT(*) FROM torrents_clienttorrent WHERE '
                          'instance_id = torrents_clientinstance.id'
     }).order_by('-torrent_count').values_list('id', flat=True)
     if not len(instances):
-        if len(avoid_ids):
+        if len(tripped_ids):
+            raise Exception('No instances are available, {0} are failing'.format(
+                ', '.join(str(i) for i in sorted(tripped_ids))))
+        elif len(avoid_ids):
             raise Exception('Torrents with the same info_hash, but different announce URLs exist, '
                             'but no more instances are available. Add more instances.')
         else:
@@ -1,3 +1,6 @@
+from operator import attrgetter
+
+from torrents.backends.base import TorrentUpdate
 from torrents.models import ClientTorrent
 
 
@@ -6,17 +9,25 @@ class SyncException(Exception):
 
 
 keys = ['info_hash', 'name', 'size_bytes', 'uploaded_bytes', 'done', 'date_added', 'error']
+# Get the fields from Torrents, TorrentUpdates and MirrorRows alike
+torrent_fields = attrgetter(*keys)
+update_fields = attrgetter(*TorrentUpdate.fields)
 
 
-def compare_dict_torrent(download_locations, values, torrent):
-    for key in keys:
-        if values[key] != torrent.__dict__[key]:
-            return False
-    if download_locations[values['location_id']].path != torrent.path:
+def compare_row_torrent(download_locations, row, torrent):
+    if torrent_fields(row) != torrent_fields(torrent):
+        return False
+    if download_locations[row.location_id].path != torrent.path:
         return False
     return True
 
 
+def client_torrent_from_update(row, update):
+    values = row.values()
+    values.update(zip(TorrentUpdate.fields, update_fields(update)))
+    return ClientTorrent(**values)
+
+
 def client_torrent_from_torrent(download_locations, instance, torrent, torrent_id=None):
     location_id = download_locations.get(torrent.path)
     if location_id is None:
@@ -28,11 +39,16 @@ def client_torrent_from_torrent(download_locations, instance, torrent, torrent_i
         instance=instance,
         location_id=download_locations[torrent.path].id,
         announces=torrent.announces,
-        **{key: torrent.__dict__[key] for key in keys}
+        **dict(zip(keys, torrent_fields(torrent)))
     )
 
 
 def compute_sync(instance, download_locations, m_torrents, t_torrents):
+    """
+    :param m_torrents: A dict of info_hash to the MirrorRows stored for the instance
+    :param t_torrents: A dict of info_hash to the Torrent or TorrentUpdate from the client
+    :return: A tuple of the new and changed ClientTorrents and the info hashes of deleted ones
+    """
     download_locations_id = {d.id: d for d in download_locations}
     download_locations_path = {d.path: d for d in download_locations}
     new_torrents = []
@@ -41,14 +57,19 @@ def compute_sync(instance, download_locations, m_torrents, t_torrents):
 
     for info_hash, t_torrent in t_torrents.items():
         m_torrent = m_torrents.get(info_hash)
-        if m_torrent is None:
+        if type(t_torrent) is TorrentUpdate:
+            # Partial records only refresh torrents that are already known
+            if m_torrent is not None and \
+                    update_fields(m_torrent) != update_fields(t_torrent):
+                changed_torrents.append(client_torrent_from_update(m_torrent, t_torrent))
+        elif m_torrent is None:
             client_torrent = client_torrent_from_torrent(
                 download_locations_path, instance, t_torrent)
             if client_torrent is not None:
                 new_torrents.append(client_torrent)
-        elif not compare_dict_torrent(download_locations_id, m_torrent, t_torrent):
+        elif not compare_row_torrent(download_locations_id, m_torrent, t_torrent):
             client_torrent = client_torrent_from_torrent(
-                download_locations_path, instance, t_torrent, torrent_id=m_torrent['id'])
+                download_locations_path, instance, t_torrent, torrent_id=m_torrent.id)
             if client_torrent is not None:
                 changed_torrents.append(client_torrent)
     for info_hash in m_torrents:
@@ -1,3 +1,4 @@
+import random
 import time
 
 
@@ -14,3 +15,98 @@ class Timer(object):
         self.end = time.time()
         self.duration = self.end - self.start
         self.logger.info('{0} took {1}'.format(self.op, self.duration))
+
+
+class InstanceUnavailableException(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a client instance after it failed failure_threshold times in a row. Once
+    reset_timeout seconds have passed, a single probe call is let through, which closes the
+    breaker if it succeeds and opens it for another reset_timeout if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def tripped(self):
+        return self.state != self.CLOSED
+
+    def allow(self):
+        """
+        :return: Whether a call can be made now. In the half open state only the probe is allowed
+        until its outcome is recorded.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+
+class AdaptiveInterval(object):
+    """
+    The time between polls of an instance. It drops to min_interval while torrents are
+    downloading, shrinks while polls find changes and grows by backoff up to max_interval while
+    they don't. An instance is never polled sooner than latency_factor times the duration of its
+    last poll, and every delay is jittered so the instances don't poll in lockstep. The delay,
+    jitter included, never exceeds max_interval, even for a slow instance.
+    """
+
+    def __init__(self, interval, min_interval, max_interval, backoff=1.5, latency_factor=5,
+                 jitter=0.2):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.jitter = jitter
+        self.latency = 0
+
+    def record(self, changes, downloading, latency):
+        """
+        :param changes: Number of torrents the poll created, changed or deleted
+        :param downloading: Number of unfinished torrents the poll saw
+        :param latency: Seconds the poll took
+        """
+        if downloading:
+            self.interval = self.min_interval
+        elif changes:
+            self.interval = max(self.min_interval, self.interval / self.backoff)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        self.latency = latency
+
+    def reset(self):
+        """
+        Goes back to min_interval, e.g. when new torrents were added.
+        """
+        self.interval = self.min_interval
+
+    def delay(self):
+        delay = max(self.interval, self.latency * self.latency_factor)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(self.max_interval, delay)
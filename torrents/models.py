@@ -5,7 +5,7 @@ from django.db import models
 from django.utils.functional import cached_property
 
 from WhatManager3.utils import json_loads, json_dumps
-from torrents.utils import decode_announces, encode_announces, hash_announces
+from torrents.utils import decode_announces, intern_announces
 
 
 class TorrentManager(models.Model):
@@ -97,8 +97,7 @@ class ClientTorrent(models.Model):
 
     @announces.setter
     def announces(self, value):
-        self.announces_enc = encode_announces(value)
-        self.announces_hash = hash_announces(value)
+        self.announces_enc, self.announces_hash = intern_announces(value)
 
 
 class QueuedTorrent(models.Model):
@@ -108,9 +107,13 @@ class QueuedTorrent(models.Model):
     delay = models.FloatField(db_index=True)
     path = models.CharField(max_length=512)
 
+    @classmethod
+    def head(cls, count):
+        return list(QueuedTorrent.objects.all().order_by('delay', '-added')[:count])
+
     @classmethod
     def top(cls):
-        head = list(QueuedTorrent.objects.all().order_by('delay', '-added')[:1])
+        head = cls.head(1)
         if len(head):
             return head[0]
         else:
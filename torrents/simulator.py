@@ -0,0 +1,337 @@
+"""
+A fake Transmission RPC server for load testing the torrent manager without real daemons. Every
+instance keeps its torrents in memory and serves session-get, torrent-get (with fields, ids and
+recently-active), torrent-add and torrent-remove, including the session id handshake. Downloads
+progress and a sample of the seeding torrents upload every tick, so recently-active returns
+something to sync. Run from the project root, with a settings.py in place, with:
+
+    python3 -m torrents.simulator --instances 4 --torrents 250000
+
+and point ClientInstances with the printed params at it.
+"""
+import argparse
+import asyncio
+import base64
+from collections import deque
+import hashlib
+import random
+import time
+import uuid
+
+from tornado.platform.asyncio import AsyncIOMainLoop, to_asyncio_future
+import tornado.web
+
+from WhatManager3.utils import json_dumps, json_loads, chunks
+from torrents import bencode
+from torrents.utils import TorrentInfo
+
+
+class SimulatorException(Exception):
+    pass
+
+
+class SimulatedTorrent(object):
+    __slots__ = ('id', 'hash_string', 'name', 'total_size', 'uploaded_ever', 'percent_done',
+                 'added_date', 'error', 'error_string', 'download_dir', 'trackers')
+
+    def __init__(self, torrent_id, hash_string, name, total_size, percent_done, added_date,
+                 download_dir, trackers):
+        self.id = torrent_id
+        self.hash_string = hash_string
+        self.name = name
+        self.total_size = total_size
+        self.uploaded_ever = 0
+        self.percent_done = percent_done
+        self.added_date = added_date
+        self.error = 0
+        self.error_string = ''
+        self.download_dir = download_dir
+        self.trackers = trackers
+
+
+class SimulatedTransmission(object):
+    # Transmission considers a torrent recently active if it had activity in the last minute
+    RECENTLY_ACTIVE_SECONDS = 60
+    # Number of torrents serialized at once while writing a torrent-get response
+    RESPONSE_CHUNK_SIZE = 1000
+    # Transmission field name to SimulatedTorrent attribute
+    FIELDS = {
+        'id': 'id',
+        'hashString': 'hash_string',
+        'name': 'name',
+        'totalSize': 'total_size',
+        'uploadedEver': 'uploaded_ever',
+        'percentDone': 'percent_done',
+        'addedDate': 'added_date',
+        'error': 'error',
+        'errorString': 'error_string',
+        'downloadDir': 'download_dir',
+        'trackers': 'trackers',
+    }
+
+    def __init__(self, name='simulator', torrents=0, download_dir='/downloads',
+                 announce='http://tracker.example/announce', active=100,
+                 download_rate=10 * 1024 * 1024, upload_rate=1024 * 1024):
+        """
+        :param name: Seeds the info hashes of the generated torrents, so every instance gets
+        different ones
+        :param torrents: Number of completed torrents to start with
+        :param download_dir: Parent of the download directories of the generated torrents
+        :param active: Number of random seeding torrents that upload something every tick
+        :param download_rate: Bytes per second every unfinished torrent downloads
+        :param upload_rate: Bytes per second every active seeding torrent uploads
+        """
+        self.session_id = uuid.uuid4().hex
+        self.active = active
+        self.download_rate = download_rate
+        self.upload_rate = upload_rate
+        self.next_id = 1
+        self.torrents = {}
+        self.ids_by_hash = {}
+        self.downloading = set()
+        # Torrent id to the time of its last activity, only for the recently active ones
+        self.activity = {}
+        # (time, id) of the removed torrents, oldest first
+        self.removed = deque()
+        now = int(time.time())
+        trackers = [{'id': 0, 'tier': 0, 'announce': announce}]
+        for i in range(torrents):
+            hash_string = hashlib.sha1('{0} {1}'.format(name, i).encode()).hexdigest()
+            self._add(hash_string, 'Simulated torrent {0}'.format(i),
+                      random.randint(1, 1024) * 1024 * 1024, 1.0, now,
+                      '{0}/{1}'.format(download_dir, i), trackers)
+
+    def _add(self, hash_string, name, total_size, percent_done, added_date, download_dir,
+             trackers):
+        torrent = SimulatedTorrent(self.next_id, hash_string, name, total_size, percent_done,
+                                   added_date, download_dir, trackers)
+        self.next_id += 1
+        self.torrents[torrent.id] = torrent
+        self.ids_by_hash[hash_string] = torrent.id
+        return torrent
+
+    def tick(self, seconds):
+        """
+        Advances the downloads and the uploads of a random sample of torrents by seconds.
+        """
+        now = time.time()
+        for torrent_id in list(self.downloading):
+            torrent = self.torrents[torrent_id]
+            torrent.percent_done = min(
+                1.0, torrent.percent_done + self.download_rate * seconds / torrent.total_size)
+            if torrent.percent_done == 1.0:
+                self.downloading.remove(torrent_id)
+            self.activity[torrent_id] = now
+        if not self.torrents:
+            return
+        for i in range(self.active):
+            torrent = self.torrents.get(random.randint(1, self.next_id - 1))
+            if torrent is not None:
+                torrent.uploaded_ever += int(self.upload_rate * seconds)
+                self.activity[torrent.id] = now
+
+    def _find(self, ids):
+        """
+        :param ids: None, an id, or a list of ids and info hashes, as accepted by Transmission
+        :return: The torrents that exist
+        """
+        if ids is None:
+            return list(self.torrents.values())
+        if not isinstance(ids, list):
+            ids = [ids]
+        torrents = []
+        for torrent_id in ids:
+            if isinstance(torrent_id, str):
+                torrent_id = self.ids_by_hash.get(torrent_id.lower())
+            torrent = self.torrents.get(torrent_id)
+            if torrent is not None:
+                torrents.append(torrent)
+        return torrents
+
+    def _recently_active(self):
+        """
+        :return: The recently active torrents and the ids of the recently removed ones
+        """
+        since = time.time() - self.RECENTLY_ACTIVE_SECONDS
+        for torrent_id, activity in list(self.activity.items()):
+            if activity < since:
+                del self.activity[torrent_id]
+        while self.removed and self.removed[0][0] < since:
+            self.removed.popleft()
+        return self._find(list(self.activity.keys())), [i for t, i in self.removed]
+
+    def _torrent_get(self, arguments, tag):
+        fields = [(f, self.FIELDS[f]) for f in arguments['fields'] if f in self.FIELDS]
+        removed = None
+        if arguments.get('ids') == 'recently-active':
+            torrents, removed = self._recently_active()
+        else:
+            torrents = self._find(arguments.get('ids'))
+        yield '{"result":"success","tag":' + json_dumps(tag) + ',"arguments":{"torrents":['
+        for i, chunk in enumerate(chunks(torrents, self.RESPONSE_CHUNK_SIZE)):
+            content = json_dumps([{f: getattr(t, a) for f, a in fields} for t in chunk])
+            yield (',' if i else '') + content[1:-1]
+        yield ']'
+        if removed is not None:
+            yield ',"removed":' + json_dumps(removed)
+        yield '}}'
+
+    def _torrent_add(self, arguments):
+        data = base64.b64decode(arguments['metainfo'])
+        try:
+            info = TorrentInfo.from_binary(data)
+            bdict = bencode.bdecode(data)
+        except Exception as e:
+            raise SimulatorException('invalid or corrupt torrent file: {0}'.format(e))
+        hash_string = info.info_hash.lower()
+        torrent_id = self.ids_by_hash.get(hash_string)
+        if torrent_id is not None:
+            torrent = self.torrents[torrent_id]
+            key = 'torrent-duplicate'
+        else:
+            bdict_info = bdict[b'info']
+            if b'files' in bdict_info:
+                total_size = sum(f[b'length'] for f in bdict_info[b'files'])
+            else:
+                total_size = bdict_info[b'length']
+            trackers = [{'id': i, 'tier': tier, 'announce': announce} for i, (tier, announce) in
+                        enumerate((tier, a) for tier, t in enumerate(info.announces) for a in t)]
+            torrent = self._add(hash_string, bdict_info[b'name'].decode('utf-8', 'replace'),
+                                max(total_size, 1), 0.0, int(time.time()),
+                                arguments['download-dir'], trackers)
+            self.downloading.add(torrent.id)
+            self.activity[torrent.id] = time.time()
+            key = 'torrent-added'
+        return {
+            key: {
+                'id': torrent.id,
+                'name': torrent.name,
+                'hashString': torrent.hash_string,
+            }
+        }
+
+    def _torrent_remove(self, arguments):
+        now = time.time()
+        for torrent in self._find(arguments.get('ids')):
+            del self.torrents[torrent.id]
+            del self.ids_by_hash[torrent.hash_string]
+            self.downloading.discard(torrent.id)
+            self.activity.pop(torrent.id, None)
+            self.removed.append((now, torrent.id))
+        return {}
+
+    def _session_get(self, arguments):
+        return {
+            'version': '2.84 (simulator)',
+            'rpc-version': 15,
+            'download-dir': '/downloads',
+        }
+
+    def handle(self, request):
+        """
+        :param request: The decoded RPC request
+        :return: An iterable of the parts of the JSON response
+        """
+        method = request.get('method')
+        arguments = request.get('arguments', {})
+        tag = request.get('tag')
+        if method == 'torrent-get':
+            return self._torrent_get(arguments, tag)
+        handler = {
+            'session-get': self._session_get,
+            'torrent-add': self._torrent_add,
+            'torrent-remove': self._torrent_remove,
+        }.get(method)
+        result = 'success'
+        if handler is None:
+            result = 'method name not recognized'
+            arguments = {}
+        else:
+            try:
+                arguments = handler(arguments)
+            except SimulatorException as e:
+                result = str(e)
+                arguments = {}
+        return [json_dumps({'result': result, 'tag': tag, 'arguments': arguments})]
+
+    def call(self, method, **arguments):
+        """
+        Handles a request the way it would be received over RPC.
+        :return: The decoded response
+        """
+        return json_loads(''.join(self.handle({'method': method, 'arguments': arguments})))
+
+
+class RpcHandler(tornado.web.RequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.simulator = kwargs.pop('simulator')
+        self.latency = kwargs.pop('latency')
+        super(RpcHandler, self).__init__(*args, **kwargs)
+
+    @tornado.web.asynchronous
+    def post(self):
+        asyncio.async(self.handle_rpc())
+
+    @asyncio.coroutine
+    def handle_rpc(self):
+        if self.request.headers.get('X-Transmission-Session-Id') != self.simulator.session_id:
+            self.set_status(409)
+            self.set_header('X-Transmission-Session-Id', self.simulator.session_id)
+            self.finish('<h1>409: Conflict</h1>')
+            return
+        if self.latency:
+            yield from asyncio.sleep(random.uniform(0, 2 * self.latency))
+        request = json_loads(self.request.body.decode('utf-8'))
+        self.set_header('Content-Type', 'application/json')
+        for part in self.simulator.handle(request):
+            self.write(part)
+            # write() only buffers until finish(), so every part is sent before the next one is
+            # serialized, instead of holding the whole response in memory
+            yield from to_asyncio_future(self.flush())
+        self.finish()
+
+
+def tick_loop(loop, simulators, interval):
+    for simulator in simulators:
+        simulator.tick(interval)
+    loop.call_later(interval, tick_loop, loop, simulators, interval)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Simulates Transmission RPC servers')
+    parser.add_argument('--instances', type=int, default=1)
+    parser.add_argument('--port', type=int, default=19091,
+                        help='Port of the first instance, the rest use the following ones')
+    parser.add_argument('--torrents', type=int, default=10000,
+                        help='Completed torrents every instance starts with')
+    parser.add_argument('--download-dir', default='/downloads')
+    parser.add_argument('--active', type=int, default=100,
+                        help='Seeding torrents per instance that upload every tick')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Mean seconds added to every RPC')
+    parser.add_argument('--tick', type=float, default=1.0,
+                        help='Seconds between progress updates')
+    args = parser.parse_args()
+
+    AsyncIOMainLoop().install()
+    loop = asyncio.get_event_loop()
+    simulators = []
+    for i in range(args.instances):
+        start = time.time()
+        simulator = SimulatedTransmission(
+            'simulator {0}'.format(i), args.torrents, args.download_dir, active=args.active)
+        simulators.append(simulator)
+        port = args.port + i
+        app = tornado.web.Application([
+            tornado.web.url('/transmission/rpc', RpcHandler,
+                            kwargs={'simulator': simulator, 'latency': args.latency}),
+        ])
+        app.listen(port)
+        print('Instance {0} with {1} torrents created in {2:.1f}s, params {3}'.format(
+            i, args.torrents, time.time() - start, json_dumps({'host': 'localhost', 'port': port})))
+    loop.call_later(args.tick, tick_loop, loop, simulators, args.tick)
+    loop.run_forever()
+
+
+if __name__ == '__main__':
+    run()
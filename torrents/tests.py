@@ -1,12 +1,29 @@
 import asyncio
+import base64
+from concurrent.futures import Executor, Future
+import io
+from unittest import mock
+from urllib.parse import urlencode
 
 from django.utils import timezone
+from tornado.httputil import HTTPServerRequest, HTTPHeaders, parse_body_arguments
+from tornado.web import Application
 
 from torrents import bencode
+from torrents.backends.base import Torrent, TorrentUpdate, TorrentClientException, \
+    TorrentClientConnectionException
+from torrents.backends.transmission import TorrentClient
+from torrents.manager.main import ClientManager, DeleteManyTorrentsHandler
 from torrents.manager.sharding import choose_shard, TorrentAlreadyAddedException
+from torrents.manager.mirror import InstanceMirror, MirrorRow
+from torrents.manager.sync import compute_sync, keys as sync_keys
+from torrents.manager.utils import CircuitBreaker, AdaptiveInterval, InstanceUnavailableException
 from torrents.models import ClientTorrent, ClientInstance, TorrentManager, DownloadLocation
-from torrents.utils import encode_announces, decode_announces, TorrentInfo
+from torrents.simulator import SimulatedTransmission
+from torrents.utils import encode_announces, decode_announces, TorrentInfo, \
+    torrent_info_cache, intern_announces, hash_announces
 from WhatManager3.test_utils import TestCase, load_fixture
+from WhatManager3.utils import json_loads, json_dumps
 
 
 def _load_fixture(filename):
@@ -29,6 +46,61 @@ class BencodeTestCase(TestCase):
         bencoded2 = bencode.bencode(bdecoded)
         self.assertEqual(bencoded, bencoded2)
 
+    def test_lazy(self):
+        for data in [what_torrent_data, multi_tracker_data]:
+            lazy = bencode.bdecode_lazy(data)
+            self.assertIsInstance(lazy[b'info'][b'pieces'], memoryview)
+            self.assertEqual(bencode.materialize(lazy), bencode.bdecode(data))
+            self.assertEqual(bencode.bencode(lazy), data)
+        self.assertRaises(bencode.BTFailure, lambda: bencode.bdecode_lazy(b'd3:abci1e'))
+        self.assertRaises(bencode.BTFailure, lambda: bencode.bdecode_lazy(b'i1ei2e'))
+
+    def test_spans(self):
+        data = b'd1:ai-12e1:bl1:xd1:ci0eeee'
+        bdict, spans = bencode.bdecode_spans(data)
+        self.assertEqual(bdict, bencode.bdecode(data))
+        self.assertEqual(spans, {b'a': (4, 9), b'b': (12, 25)})
+        for start, end in spans.values():
+            self.assertEqual(data[start:end], bencode.bencode(bencode.bdecode(data[start:end])))
+
+    def test_spans_selected_keys(self):
+        data = b'd1:ai-12e1:bl1:xd1:ci0eee1:c3:abce'
+        bdict, spans = bencode.bdecode_spans(data, {b'c'})
+        self.assertEqual(bdict, {b'c': b'abc'})
+        self.assertEqual(spans, {b'a': (4, 9), b'b': (12, 25), b'c': (28, 33)})
+        self.assertRaises(bencode.BTFailure,
+                          lambda: bencode.bdecode_spans(b'd1:ad1:bi1e1:ai2ee1:c3:abce', {b'c'}))
+
+    def test_spans_non_canonical(self):
+        for data in [b'd1:bi1e1:ai2ee', b'd1:ai1e1:ai2ee', b'd1:ai+1ee', b'd1:ai-0ee',
+                     b'd1:ad1:bi1e1:ai2eee', b'd1:a01:xe', b'li1ee', b'd1:ai1ee1',
+                     # Keys with padded lengths, at the top level and nested
+                     b'd01:ai1ee', b'd+1:ai1ee', b'd 1:ai1ee', b'd1_0:aaaaaaaaaai1ee',
+                     b'd1:ad+1:bi1eee', b'd1:ad01:bi1eee']:
+            self.assertRaises(bencode.BTFailure, lambda: bencode.bdecode_spans(data))
+
+
+class StreamEncoderTestCase(TestCase):
+    def test_matches_bencode(self):
+        for data in [what_torrent_data, multi_tracker_data]:
+            encoder = bencode.StreamEncoder(bencode.bdecode_lazy(data))
+            self.assertEqual(encoder.size(), len(data))
+            buf = bytearray(encoder.size())
+            self.assertEqual(encoder.into(buf), len(data))
+            self.assertEqual(buf, data)
+            f = io.BytesIO()
+            encoder.write(f, buffer_size=1024)
+            self.assertEqual(f.getvalue(), data)
+
+    def test_deep_nesting(self):
+        value = []
+        for i in range(10000):
+            value = [value]
+        self.assertEqual(bencode.StreamEncoder(value).size(), 20002)
+
+    def test_unsupported_type(self):
+        self.assertRaises(bencode.BTFailure, lambda: bencode.StreamEncoder([1.5]).size())
+
 
 class AnnounceEncodingTestCase(TestCase):
     def test_roundtrip(self):
@@ -38,6 +110,14 @@ class AnnounceEncodingTestCase(TestCase):
         self.encode_decode([['hi', 'boo'], ['hi2']])
         self.encode_decode([['hi', 'boo'], ['hi2', 'boo2']])
 
+    def test_intern(self):
+        announces = [['http://a1', 'http://a2'], ['http://b']]
+        announces_enc, announces_hash = intern_announces(announces)
+        self.assertEqual(announces_enc, encode_announces(announces))
+        self.assertEqual(announces_hash, hash_announces(announces))
+        self.assertIs(intern_announces([list(t) for t in announces])[0], announces_enc)
+        self.assertNotEqual(intern_announces([['http://b']])[1], announces_hash)
+
     def encode_decode(self, data):
         encoded = encode_announces(data)
         decoded = decode_announces(encoded)
@@ -56,18 +136,362 @@ class TorrentInfoTestCase(TestCase):
     def test_parsing_single(self):
         self.do_test_parsing(what_torrent_data)
 
+    def test_info_hash_from_span(self):
+        for data in [what_torrent_data, multi_tracker_data]:
+            bdict = bencode.bdecode(data)
+            self.assertEqual(TorrentInfo.from_binary(data).info_hash,
+                             TorrentInfo(bdict).info_hash)
+
+    def test_parsing_cached(self):
+        hits = torrent_info_cache.hits
+        info = TorrentInfo.from_binary_cached(multi_tracker_data)
+        self.assertIs(TorrentInfo.from_binary_cached(multi_tracker_data), info)
+        self.assertEqual(torrent_info_cache.hits, hits + 1)
+        self.assertEqual(info.info_hash, TorrentInfo.from_binary(multi_tracker_data).info_hash)
+
     def test_parsing_multiple(self):
         info = self.do_test_parsing(multi_tracker_data)
         self.assertEqual(info.announces, [['http://a1', 'http://a2']])
 
 
+class SyncTestCase(TestCase):
+    def setUp(self):
+        self.location = DownloadLocation(id=1000, path='/downloads')
+        self.instance = ClientInstance(id=1)
+        self.date_added = timezone.now()
+        super(SyncTestCase, self).setUp()
+
+    def torrent(self, info_hash, **kwargs):
+        fields = {
+            'info_hash': info_hash,
+            'path': '/downloads',
+            'name': 'Torrent',
+            'size_bytes': 100,
+            'uploaded_bytes': 0,
+            'done': 0.5,
+            'date_added': self.date_added,
+            'error': None,
+            'announces': [['http://a']],
+        }
+        fields.update(kwargs)
+        return Torrent(**fields)
+
+    def row(self, torrent_id, torrent):
+        client_torrent = ClientTorrent(id=torrent_id, instance=self.instance,
+                                       location=self.location, announces=torrent.announces,
+                                       **{key: getattr(torrent, key) for key in sync_keys})
+        return MirrorRow.from_client_torrent(client_torrent)
+
+    def test_compute_sync(self):
+        same, changed, deleted = self.torrent('A'), self.torrent('B'), self.torrent('C')
+        m_torrents = {
+            'A': self.row(1, same),
+            'B': self.row(2, changed),
+            'C': self.row(3, deleted),
+        }
+        t_torrents = {
+            'A': same,
+            'B': self.torrent('B', uploaded_bytes=10),
+            'D': self.torrent('D'),
+        }
+        new_torrents, changed_torrents, deleted_hashes = compute_sync(
+            self.instance, [self.location], m_torrents, t_torrents)
+        self.assertEqual([t.info_hash for t in new_torrents], ['D'])
+        self.assertEqual([(t.id, t.uploaded_bytes) for t in changed_torrents], [(2, 10)])
+        self.assertEqual(deleted_hashes, ['C'])
+
+    def test_compute_sync_partial(self):
+        same, changed = self.torrent('A'), self.torrent('B')
+        m_torrents = {
+            'A': self.row(1, same),
+            'B': self.row(2, changed),
+        }
+        t_torrents = {
+            'A': TorrentUpdate('A', same.uploaded_bytes, same.done, same.error),
+            'B': TorrentUpdate('B', 10, 1, 'Tracker error'),
+            'D': TorrentUpdate('D', 0, 0, None),
+        }
+        new_torrents, changed_torrents, deleted_hashes = compute_sync(
+            self.instance, [self.location], m_torrents, t_torrents)
+        self.assertEqual((new_torrents, deleted_hashes), ([], []))
+        self.assertEqual(len(changed_torrents), 1)
+        torrent = changed_torrents[0]
+        self.assertEqual((torrent.id, torrent.uploaded_bytes, torrent.done, torrent.error),
+                         (2, 10, 1, 'Tracker error'))
+        self.assertEqual((torrent.name, torrent.size_bytes, torrent.location_id),
+                         (changed.name, changed.size_bytes, self.location.id))
+
+    def test_mirror(self):
+        mirror = InstanceMirror()
+        mirror.load([self.row(1, self.torrent('A')), self.row(2, self.torrent('B', done=1))])
+        self.assertEqual(mirror.downloading, {'A'})
+        t_torrents = {
+            'A': self.torrent('A', done=1),
+            'C': self.torrent('C'),
+        }
+        new_torrents, changed_torrents, deleted_hashes = compute_sync(
+            self.instance, [self.location], mirror.torrents, t_torrents)
+        rows = {1: self.row(1, t_torrents['A']), 3: self.row(3, t_torrents['C'])}
+        mirror.apply([rows[3]], changed_torrents, deleted_hashes)
+        self.assertEqual(mirror.torrents, {'A': rows[1], 'C': rows[3]})
+        self.assertEqual(mirror.hashes_by_id, {1: 'A', 3: 'C'})
+        self.assertEqual(mirror.downloading, {'C'})
+        self.assertEqual(mirror.select(['A', 'B']), {'A': rows[1]})
+        self.assertEqual(mirror.count_differences({'A': rows[1], 'C': rows[3]}), 0)
+        self.assertEqual(mirror.count_differences({'A': rows[3], 'D': rows[3]}), 3)
+        # The rows share the announces strings and the ids of their instance and location
+        row = self.row(4, self.torrent('D'))
+        # Read from the database, equal ids are separate objects
+        row.location_id = int(str(self.location.id))
+        mirror.apply([row], [], [])
+        for column in ['announces_enc', 'instance_id', 'location_id']:
+            self.assertIs(getattr(row, column), getattr(mirror.torrents['C'], column))
+
+
+class TransmissionTestCase(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = TorrentClient(loop=self.loop)
+        super(TransmissionTestCase, self).setUp()
+
+    def tearDown(self):
+        self.client.close()
+        self.loop.close()
+        super(TransmissionTestCase, self).tearDown()
+
+    def item(self, torrent_id, info_hash):
+        return {
+            'id': torrent_id,
+            'hashString': info_hash.lower(),
+            'name': 'Torrent',
+            'totalSize': 100,
+            'uploadedEver': 0,
+            'percentDone': 1,
+            'addedDate': 0,
+            'error': 0,
+            'errorString': '',
+            'downloadDir': '/downloads/Torrent',
+            'trackers': [{'tier': 0, 'announce': 'http://a'}],
+        }
+
+    def respond(self, responses):
+        """
+        Makes the client get responses, fed to the parser in small chunks.
+        :return: The list the arguments of the requests are appended to
+        """
+        requests = []
+
+        @asyncio.coroutine
+        def _post(body, parser=None):
+            requests.append(json_loads(body.decode('utf-8'))['arguments'])
+            content = json_dumps({'arguments': responses.pop(0), 'result': 'success'})
+            content = content.encode('utf-8')
+            if parser is None:
+                return 200, content
+            for i in range(0, len(content), 7):
+                parser.feed(content[i:i + 7])
+            return 200, None
+        self.client._post = _post
+        return requests
+
+    def test_recently_active(self):
+        self.respond([
+            {'torrents': [self.item(1, 'A' * 40), self.item(2, 'B' * 40)]},
+            {'torrents': [self.item(2, 'B' * 40)], 'removed': [1, 3]},
+        ])
+        self.loop.run_until_complete(self.client.get_torrents())
+        torrents, removed_hashes = self.loop.run_until_complete(
+            self.client.get_recently_active())
+        self.assertEqual([t.info_hash for t in torrents], ['B' * 40])
+        self.assertEqual(torrents[0].path, '/downloads')
+        self.assertEqual(removed_hashes, ['A' * 40])
+        self.assertEqual(self.client.hashes_by_id, {2: 'B' * 40})
+
+    def test_numeric_ids(self):
+        requests = self.respond([
+            {'torrents': [self.item(1, 'A' * 40), self.item(2, 'B' * 40)]},
+            # Transmission restarted and gave B another id
+            {'torrents': [self.item(1, 'A' * 40), self.item(2, 'C' * 40)]},
+            {'torrents': [self.item(5, 'B' * 40)]},
+        ])
+        self.loop.run_until_complete(self.client.get_torrents())
+        torrents = self.loop.run_until_complete(
+            self.client.get_torrents(['A' * 40, 'B' * 40], light=True))
+        self.assertEqual([r['ids'] for r in requests[1:]], [[1, 2], ['B' * 40]])
+        self.assertEqual(requests[1]['fields'], TorrentClient.LIGHT_FIELDS)
+        self.assertEqual(sorted(t.info_hash for t in torrents), ['A' * 40, 'B' * 40])
+        self.assertIsInstance(torrents[0], TorrentUpdate)
+        self.assertEqual(self.client.ids_by_hash, {'A' * 40: 1, 'B' * 40: 5, 'C' * 40: 2})
+
+    def test_delete_torrents(self):
+        requests = self.respond([{}])
+        self.loop.run_until_complete(self.client.delete_torrents(['A' * 40, 'B' * 40]))
+        self.assertEqual(requests, [{'ids': ['A' * 40, 'B' * 40], 'delete-local-data': True}])
+
+
+class SimulatorTestCase(TestCase):
+    def setUp(self):
+        self.simulator = SimulatedTransmission('test', torrents=3, active=0)
+        self.info = TorrentInfo.from_binary(what_torrent_data)
+        super(SimulatorTestCase, self).setUp()
+
+    def get(self, ids, fields=('id', 'hashString', 'percentDone')):
+        return self.simulator.call('torrent-get', ids=ids, fields=list(fields))['arguments']
+
+    def test_rpc(self):
+        response = self.simulator.call(
+            'torrent-add', metainfo=base64.b64encode(what_torrent_data).decode(),
+            **{'download-dir': '/downloads/what'})
+        self.assertEqual(response['result'], 'success')
+        self.assertEqual(response['arguments']['torrent-added']['id'], 4)
+        response = self.simulator.call(
+            'torrent-add', metainfo=base64.b64encode(what_torrent_data).decode(),
+            **{'download-dir': '/downloads/what'})
+        self.assertEqual(response['arguments']['torrent-duplicate']['id'], 4)
+        torrents = self.get([self.info.info_hash], ['id', 'percentDone', 'trackers'])['torrents']
+        self.assertEqual(torrents[0]['percentDone'], 0)
+        self.assertEqual(torrents[0]['trackers'][0]['announce'], self.info.announces[0][0])
+        self.simulator.tick(3600)
+        self.assertEqual(self.get([4])['torrents'][0]['percentDone'], 1)
+        self.simulator.call('torrent-remove', ids=[1], **{'delete-local-data': True})
+        recent = self.get('recently-active')
+        self.assertEqual([t['id'] for t in recent['torrents']], [4])
+        self.assertEqual(recent['removed'], [1])
+        self.assertEqual(sorted(t['id'] for t in self.get(None)['torrents']), [2, 3, 4])
+        self.assertEqual(self.simulator.call('torrent-stop')['result'],
+                         'method name not recognized')
+
+    def test_client(self):
+        loop = asyncio.new_event_loop()
+        client = TorrentClient(loop=loop)
+
+        @asyncio.coroutine
+        def _post(body, parser=None):
+            parts = self.simulator.handle(json_loads(body.decode('utf-8')))
+            content = ''.join(parts).encode('utf-8')
+            if parser is None:
+                return 200, content
+            parser.feed(content)
+            return 200, None
+        client._post = _post
+        try:
+            torrents = loop.run_until_complete(client.get_torrents())
+            self.assertEqual(len(torrents), 3)
+            self.assertEqual(torrents[0].path, '/downloads')
+        finally:
+            client.close()
+            loop.close()
+
+    def simulate_http(self, loop):
+        """
+        Patches aiohttp.request to answer from self.simulator the way RpcHandler does, including
+        the session id handshake.
+        """
+        @asyncio.coroutine
+        def request(method, url, data=None, headers=None, **kwargs):
+            content = asyncio.StreamReader(loop=loop)
+            response = mock.Mock(
+                content=content, read=content.read,
+                headers={'X-TRANSMISSION-SESSION-ID': self.simulator.session_id})
+            if headers['X-TRANSMISSION-SESSION-ID'] != self.simulator.session_id:
+                response.status = 409
+                content.feed_data(b'<h1>409: Conflict</h1>')
+            else:
+                response.status = 200
+                parts = self.simulator.handle(json_loads(data.decode('utf-8')))
+                content.feed_data(''.join(parts).encode('utf-8'))
+            content.feed_eof()
+            return response
+        return mock.patch('aiohttp.request', request)
+
+    def test_restart(self):
+        loop = asyncio.new_event_loop()
+        client = TorrentClient(loop=loop)
+        try:
+            with self.simulate_http(loop):
+                loop.run_until_complete(client.start())
+                loop.run_until_complete(client.get_torrents(light=True))
+                self.assertEqual(len(client.hashes_by_id), 3)
+                # The restarted Transmission has a new session and gave the ids to other torrents
+                self.simulator = SimulatedTransmission('restarted', torrents=3, active=0)
+                self.simulator.call('torrent-remove', ids=[1], **{'delete-local-data': True})
+                torrents, removed = loop.run_until_complete(client.get_recently_active())
+                self.assertEqual(removed, [])
+                self.assertEqual(client.hashes_by_id, {})
+                info_hash = self.simulator.torrents[2].hash_string.upper()
+                torrents = loop.run_until_complete(client.get_torrents([info_hash], light=True))
+                self.assertEqual([t.info_hash for t in torrents], [info_hash])
+                self.assertEqual(client.ids_by_hash[info_hash], 2)
+        finally:
+            client.close()
+            loop.close()
+
+
+class CircuitBreakerTestCase(TestCase):
+    def test_states(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        breaker.failure()
+        self.assertFalse(breaker.tripped)
+        breaker.failure()
+        self.assertTrue(breaker.tripped)
+        self.assertFalse(breaker.allow())
+        now[0] = 10
+        # Only one probe is let through, and it failing opens the breaker again
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertFalse(breaker.tripped)
+        self.assertTrue(breaker.allow())
+
+
+class AdaptiveIntervalTestCase(TestCase):
+    def test_record(self):
+        interval = AdaptiveInterval(4, 1, 16, backoff=2, latency_factor=5, jitter=0)
+        interval.record(0, 0, 0.1)
+        self.assertEqual(interval.delay(), 8)
+        for i in range(10):
+            interval.record(0, 0, 0.1)
+        self.assertEqual(interval.delay(), 16)
+        interval.record(3, 0, 0.1)
+        self.assertEqual(interval.delay(), 8)
+        interval.record(3, 1, 0.1)
+        self.assertEqual(interval.delay(), 1)
+        # A slow instance isn't polled more often than its latency allows
+        interval.record(0, 1, 2)
+        self.assertEqual(interval.delay(), 10)
+        interval = AdaptiveInterval(4, 1, 16, jitter=0.5)
+        for i in range(100):
+            self.assertTrue(2 <= interval.delay() <= 6)
+
+    def test_clamped(self):
+        interval = AdaptiveInterval(16, 1, 16, jitter=0.5)
+        for i in range(100):
+            self.assertTrue(8 <= interval.delay() <= 16)
+        # A slow instance is still polled within max_interval
+        interval.record(0, 0, 10)
+        for i in range(100):
+            self.assertEqual(interval.delay(), 16)
+        self.assertLess(ClientManager.MAX_UPDATE_INTERVAL,
+                        SimulatedTransmission.RECENTLY_ACTIVE_SECONDS)
+
+
 class ShardingTestCase(TestCase):
     def setUp(self):
         self.info = TorrentInfo.from_binary(what_torrent_data)
         super(ShardingTestCase, self).setUp()
 
-    def choose_shard(self, locked_instances):
-        return choose_shard(locked_instances, self.info.announces_hash, self.info.info_hash)
+    def choose_shard(self, locked_instances, tripped_instances=()):
+        return choose_shard(locked_instances, self.info.announces_hash, self.info.info_hash,
+                            tripped_instances)
 
     def create_instance(self):
         try:
@@ -120,3 +544,147 @@ class ShardingTestCase(TestCase):
             self.assertEqual(self.choose_shard([]), b.id)
         self.assertEqual(self.choose_shard([a]), b.id)
         self.assertEqual(self.choose_shard([b]), b.id)
+
+    def test_tripped(self):
+        a = self.create_instance()
+        b = self.create_instance()
+        for i in range(20):
+            self.assertEqual(self.choose_shard([], [a]), b.id)
+        self.assertEqual(self.choose_shard([b], [a]), b.id)
+        self.assertRaisesMessage(
+            Exception, 'No instances are available, {0}, {1} are failing'.format(a.id, b.id),
+            lambda: self.choose_shard([], [a, b])
+        )
+
+
+class InlineExecutor(Executor):
+    """
+    Runs functions as they are submitted, so database access stays on the connection of the test.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class StubClient(object):
+    def __init__(self, fail=False, loop=None):
+        self.fail = fail
+        self.loop = loop
+        self.added = []
+        self.deleted = []
+
+    @asyncio.coroutine
+    def add_torrent(self, torrent_data, add_path):
+        # Stays in flight for a while, like a real torrent-add
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        self.added.append(TorrentInfo.from_binary(torrent_data).info_hash)
+
+    @asyncio.coroutine
+    def delete_torrents(self, info_hashes):
+        if self.fail:
+            raise TorrentClientException('Connection refused')
+        self.deleted.append(sorted(info_hashes))
+
+
+class ClientManagerTestCase(TestCase):
+    def setUp(self):
+        super(ClientManagerTestCase, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.torrent_manager = TorrentManager(host='0.0.0.0', port=0)
+        self.torrent_manager.save()
+        self.location = DownloadLocation(path='', manager=self.torrent_manager)
+        self.location.save()
+
+    def tearDown(self):
+        self.loop.close()
+        super(ClientManagerTestCase, self).tearDown()
+
+    def create_torrent(self, instance, info_hash):
+        torrent = ClientTorrent(announces=[['a']], info_hash=info_hash, instance=instance,
+                                location=self.location, size_bytes=0, uploaded_bytes=0, done=1,
+                                date_added=timezone.now())
+        torrent.save()
+        return torrent
+
+    def post(self, manager, torrent_ids):
+        body = urlencode([('id', torrent_id) for torrent_id in torrent_ids]).encode('utf-8')
+        request = HTTPServerRequest(
+            'POST', '/torrents/delete_many', body=body, connection=mock.Mock(),
+            headers=HTTPHeaders({'Content-Type': 'application/x-www-form-urlencoded'}))
+        parse_body_arguments(request.headers['Content-Type'], body, request.body_arguments,
+                             request.files)
+        handler = DeleteManyTorrentsHandler(Application(), request, updater=manager)
+        return self.loop.run_until_complete(handler.post_json())
+
+    def test_delete_torrents(self):
+        a = ClientInstance(manager=self.torrent_manager)
+        a.save()
+        b = ClientInstance(manager=self.torrent_manager)
+        b.save()
+        a_torrents = [self.create_torrent(a, 'A' * 40), self.create_torrent(a, 'B' * 40)]
+        b_torrent = self.create_torrent(b, 'C' * 40)
+        manager = ClientManager(self.torrent_manager, self.loop)
+        manager.read_pool = manager.write_pool = InlineExecutor()
+        a_client = manager.instances[a.id].client = StubClient()
+        manager.instances[b.id].client = StubClient(fail=True)
+        unknown_id = b_torrent.id + 1
+        response = self.post(manager, [t.id for t in a_torrents] + [b_torrent.id, unknown_id])
+        self.assertTrue(response['success'])
+        results = response['results']
+        # Both torrents of a are removed with one RPC
+        self.assertEqual(a_client.deleted, [['A' * 40, 'B' * 40]])
+        for torrent in a_torrents:
+            self.assertEqual(results[torrent.id], {'success': True})
+        self.assertEqual(results[b_torrent.id]['error_code'], 'client_error')
+        self.assertEqual(results[unknown_id]['error_code'], 'torrent_not_found')
+        self.assertEqual(list(ClientTorrent.objects.values_list('id', flat=True)),
+                         [b_torrent.id])
+        self.assertEqual(self.post(manager, ['x'])['error_code'], 'missing_parameter')
+
+    def test_call_client(self):
+        instance = ClientInstance(manager=self.torrent_manager)
+        instance.save()
+        manager = ClientManager(self.torrent_manager, self.loop)
+        instance = manager.instances[instance.id]
+
+        @asyncio.coroutine
+        def fail(exception):
+            raise exception
+
+        def call(exception):
+            self.assertRaises(type(exception), self.loop.run_until_complete,
+                              manager.call_client(instance, fail(exception)))
+        # Errors the instance answers with show that it's up
+        for i in range(manager.BREAKER_FAILURES):
+            call(TorrentClientException('invalid or corrupt torrent file'))
+        self.assertFalse(instance.breaker.tripped)
+        call(TorrentClientConnectionException('Connection refused'))
+        self.assertRaises(asyncio.TimeoutError, self.loop.run_until_complete, manager.call_client(
+            instance, asyncio.sleep(1, loop=self.loop), timeout=0.01))
+        call(TorrentClientConnectionException('Connection refused'))
+        self.assertTrue(instance.breaker.tripped)
+        call(InstanceUnavailableException())
+
+    def test_add_burst(self):
+        for i in range(2):
+            ClientInstance(manager=self.torrent_manager).save()
+        manager = ClientManager(self.torrent_manager, self.loop)
+        manager.read_pool = manager.write_pool = InlineExecutor()
+        manager.sync_added_torrent = asyncio.coroutine(lambda instance, info_hash: None)
+        for instance in manager.instances.values():
+            instance.client = StubClient(loop=self.loop)
+        torrents = []
+        for i in range(manager.SIMULTANEOUS_ADDS * len(manager.instances)):
+            bdict = bencode.bdecode(what_torrent_data)
+            bdict[b'info'][b'name'] = 'Torrent {0}'.format(i).encode()
+            torrents.append(bencode.bencode(bdict))
+        # All adds of a batch start at once, as in queue_pop
+        self.loop.run_until_complete(asyncio.gather(
+            *[manager.add_torrent(data, '') for data in torrents], loop=self.loop))
+        self.assertEqual([len(i.client.added) for i in manager.instances.values()],
+                         [manager.SIMULTANEOUS_ADDS] * len(manager.instances))
@@ -1,9 +1,15 @@
 import hashlib
 from urllib.parse import urlparse
 
+from WhatManager3.settings import TORRENT_INFO_CACHE_BYTES
+from WhatManager3.utils import LRUCache
 from torrents import bencode
 
 
+# The only top-level keys TorrentInfo needs decoded. info is hashed from its raw span.
+TORRENT_INFO_KEYS = frozenset([b'announce', b'announce-list'])
+
+
 def extract_domain(url):
     parsed = urlparse(url)
     return parsed.netloc
@@ -22,8 +28,30 @@ def encode_announces(announces):
     return result
 
 
+# Maps announce lists (as tuples of tuples) to (announces_enc, announces_hash). There are only
+# a handful of distinct announce lists, so this saves encoding and hashing them on every sync.
+interned_announces = {}
+INTERNED_ANNOUNCES_LIMIT = 4096
+
+
+def intern_announces(announces):
+    """
+    Returns (announces_enc, announces_hash) for the announces, computed once per distinct
+    announce list per process.
+    """
+    key = tuple(tuple(tier) for tier in announces)
+    result = interned_announces.get(key)
+    if result is None:
+        announces_enc = encode_announces(announces)
+        result = (announces_enc, hex_digest(announces_enc.encode('utf-8')))
+        if len(interned_announces) >= INTERNED_ANNOUNCES_LIMIT:
+            interned_announces.clear()
+        interned_announces[key] = result
+    return result
+
+
 def hash_announces(announces):
-    return hex_digest(encode_announces(announces).encode('utf-8'))
+    return intern_announces(announces)[1]
 
 
 def decode_announces(announces):
@@ -31,21 +59,52 @@ def decode_announces(announces):
 
 
 class TorrentInfo(object):
-    def __init__(self, bdict):
-        info = bdict[b'info']
-        self.info_hash = hex_digest(bencode.bencode(info))
+    def __init__(self, bdict, info_hash=None):
+        """
+        :param bdict: The decoded torrent dict
+        :param info_hash: The info_hash if already known, otherwise it is computed from
+        bdict[b'info']
+        """
+        if info_hash is None:
+            info_hash = hex_digest(bencode.bencode(bdict[b'info']))
+        self.info_hash = info_hash
         if b'announce-list' in bdict:
             self.announces = [[a.decode('utf-8') for a in t] for t in bdict[b'announce-list']]
         else:
             self.announces = [[bdict[b'announce'].decode('utf-8')]]
         self.announces_hash = hash_announces(self.announces)
+        # Position of the bencoded info dict in the original data, set by from_binary
+        self.info_span = None
 
     @classmethod
     def from_binary(cls, data):
-        bdict = bencode.bdecode(data)
-        return TorrentInfo(bdict)
+        bdict, spans = bencode.bdecode_spans(data, TORRENT_INFO_KEYS)
+        start, end = spans[b'info']
+        info = TorrentInfo(bdict, hex_digest(memoryview(data)[start:end]))
+        info.info_span = (start, end)
+        return info
+
+    @classmethod
+    def from_binary_cached(cls, data):
+        """
+        Same as from_binary, but goes through a per-process cache keyed by the SHA1 of data, so
+        the same torrent is only parsed once along the add pipeline. The returned instance is
+        shared and must not be modified.
+        """
+        key = hashlib.sha1(data).digest()
+        info = torrent_info_cache.get(key)
+        if info is None:
+            info = cls.from_binary(data)
+            torrent_info_cache.put(key, info, info.size_estimate())
+        return info
+
+    def size_estimate(self):
+        return 512 + sum(len(a) for tier in self.announces for a in tier)
 
     @classmethod
     def from_file(cls, file_path):
         with open(file_path, 'rb') as f:
             return cls.from_binary(f.read())
+
+
+torrent_info_cache = LRUCache(TORRENT_INFO_CACHE_BYTES)
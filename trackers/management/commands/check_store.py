@@ -0,0 +1,163 @@
+from binascii import unhexlify, hexlify
+from multiprocessing import Pool
+from optparse import make_option
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from WhatManager3 import settings
+from WhatManager3.utils import chunks, IN_QUERY_CHUNK_SIZE
+from torrents.models import ClientTorrent, QueuedTorrent
+from trackers.models import TrackerTorrentBase
+from trackers.store import store_backends
+
+
+# Number of store entries sent to a worker at a time
+CHECK_CHUNK_SIZE = 1000
+# Number of rows fetched per query when scanning the tables that reference stored torrents
+QUERY_CHUNK_SIZE = 10000
+
+worker_store = None
+
+
+def init_worker():
+    global worker_store
+    worker_store = store_backends[settings.TORRENT_STORE_BACKEND]()
+
+
+def check_keys(keys):
+    """
+    Runs in a worker process.
+    :param keys: A list of (announces_hash, info_hash) of stored torrents
+    :return: A tuple of the keys of all intact torrents concatenated as binary and a list of
+    (announces_hash, info_hash, problem) for the others
+    """
+    intact = []
+    problems = []
+    for announces_hash, info_hash in keys:
+        problem = worker_store.check(announces_hash, info_hash)
+        if problem is None:
+            intact.append(store_key(announces_hash, info_hash))
+        else:
+            problems.append((announces_hash, info_hash, problem))
+    return b''.join(intact), problems
+
+
+def store_key(announces_hash, info_hash):
+    return unhexlify(announces_hash) + unhexlify(info_hash)
+
+
+def split_key(key):
+    return hexlify(key[:20]).decode().upper(), hexlify(key[20:]).decode().upper()
+
+
+def scan_keys(model):
+    """
+    Iterates over the (pk, announces_hash, info_hash) of all rows of model, fetched in chunks.
+    """
+    last_pk = None
+    while True:
+        queryset = model.objects.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list('pk', 'announces_hash', 'info_hash')[:QUERY_CHUNK_SIZE])
+        for row in rows:
+            yield row
+        if len(rows) < QUERY_CHUNK_SIZE:
+            return
+        last_pk = rows[-1][0]
+
+
+class Command(BaseCommand):
+    help = ('Verifies every torrent in the torrent store against its hashes and cross-references '
+            'the store with the tracker torrents, client torrents and queue to find orphaned and '
+            'missing torrents.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=os.cpu_count(),
+                    help='Number of processes verifying stored torrents'),
+        make_option('--delete', action='store_true', dest='delete', default=False,
+                    help='Delete orphaned torrents and unused info dicts from the store'),
+    )
+
+    def handle(self, *args, **options):
+        store = store_backends[settings.TORRENT_STORE_BACKEND]()
+        verbosity = int(options['verbosity'])
+        tracker_models = [m for m in apps.get_models() if issubclass(m, TrackerTorrentBase)]
+        # Torrents in these tables are added from the store, so they must be there
+        required_models = tracker_models + [QueuedTorrent]
+
+        # The store is listed completely before the tables are scanned, so torrents put into the
+        # store along with their rows while this runs are never considered orphans.
+        stored = set()
+        corrupt_info_hashes = set()
+        corrupt = 0
+        pool = Pool(options['workers'], init_worker)
+        try:
+            results = pool.imap_unordered(check_keys, chunks(store.keys(), CHECK_CHUNK_SIZE))
+            for intact, problems in results:
+                stored.update(intact[i:i + 40] for i in range(0, len(intact), 40))
+                for announces_hash, info_hash, problem in problems:
+                    self.stdout.write('Corrupt {0}/{1}: {2}'.format(
+                        announces_hash, info_hash, problem))
+                    corrupt_info_hashes.add(info_hash.upper())
+                corrupt += len(problems)
+                if verbosity >= 2:
+                    self.stdout.write('Checked {0} torrents'.format(len(stored) + corrupt))
+        finally:
+            pool.close()
+            pool.join()
+
+        orphans = set(stored)
+        missing = 0
+        for model in required_models + [ClientTorrent]:
+            for pk, announces_hash, info_hash in scan_keys(model):
+                key = store_key(announces_hash, info_hash)
+                orphans.discard(key)
+                if key not in stored and model in required_models:
+                    self.stdout.write('Missing {0}/{1} of {2} {3}'.format(
+                        announces_hash, info_hash, model.__name__, pk))
+                    missing += 1
+
+        used_info_hashes = {split_key(key)[1] for key in stored} | corrupt_info_hashes
+        unused_info_hashes = [info_hash for info_hash in store.info_hashes()
+                              if info_hash.upper() not in used_info_hashes]
+
+        self.stdout.write('{0} torrents checked, {1} corrupt, {2} missing, {3} orphaned, '
+                          '{4} unused info dicts'.format(len(stored) + corrupt, corrupt, missing,
+                                                         len(orphans), len(unused_info_hashes)))
+        if verbosity >= 2:
+            for key in orphans:
+                self.stdout.write('Orphaned {0}/{1}'.format(*split_key(key)))
+        if options['delete']:
+            deleted = self.delete_orphans(store, required_models + [ClientTorrent], orphans)
+            deleted_infos = 0
+            for info_hash in unused_info_hashes:
+                # A torrent using it may have been put since the store was listed
+                if store.remove_unused_info(info_hash):
+                    deleted_infos += 1
+            self.stdout.write('Deleted {0} orphaned torrents and {1} unused info dicts'.format(
+                deleted, deleted_infos))
+
+    def delete_orphans(self, store, models, orphans):
+        """
+        Checks the orphans against the tables once more, in case rows were created for them since
+        the scan, and deletes the ones that are still unreferenced.
+        """
+        deleted = 0
+        for chunk in chunks(sorted(orphans, key=lambda k: k[20:]), IN_QUERY_CHUNK_SIZE):
+            keys = [split_key(key) for key in chunk]
+            referenced = set()
+            for model in models:
+                referenced.update(model.objects.filter(
+                    info_hash__in={info_hash for announces_hash, info_hash in keys}
+                ).values_list('announces_hash', 'info_hash'))
+            for announces_hash, info_hash in keys:
+                if (announces_hash, info_hash) in referenced:
+                    continue
+                try:
+                    store.delete(announces_hash, info_hash)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
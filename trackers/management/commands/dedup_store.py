@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from torrents.utils import TorrentInfo
+from trackers.store import TorrentStore, ENVELOPE_MAGIC, make_envelope
+
+
+class Command(BaseCommand):
+    help = ('Stores the info dict of every torrent in the torrent store only once and reports the '
+            'disk space used and saved by doing so.')
+    option_list = BaseCommand.option_list + (
+        make_option('--report', action='store_true', dest='report', default=False,
+                    help='Only report the disk space used, without converting any torrents'),
+    )
+
+    def handle(self, *args, **options):
+        store = TorrentStore.create()
+        if not options['report'] and not store.dedup_info:
+            raise CommandError('Set STORE_DEDUP_INFO to convert the stored torrents')
+        logical_bytes = 0
+        stored_bytes = 0
+        info_hashes = set()
+        count = 0
+        for announces_hash, info_hash in list(store.keys()):
+            data = store.read(announces_hash, info_hash)
+            if data[:1] != ENVELOPE_MAGIC and not options['report']:
+                info = TorrentInfo.from_binary(data)
+                start, end = info.info_span
+                if not store.exists(None, info_hash):
+                    store.write_many([(None, info_hash, data[start:end])])
+                store.write_many([(announces_hash, info_hash, make_envelope(data, start, end))])
+                logical_bytes += len(data)
+                data = store.read(announces_hash, info_hash)
+            else:
+                logical_bytes += len(store.get(announces_hash, info_hash))
+            stored_bytes += len(data)
+            if data[:1] == ENVELOPE_MAGIC and info_hash not in info_hashes:
+                info_hashes.add(info_hash)
+                stored_bytes += store.size(None, info_hash)
+            count += 1
+            if count % 1000 == 0:
+                self.stdout.write('Processed {0} torrents'.format(count))
+        saved_bytes = logical_bytes - stored_bytes
+        self.stdout.write('{0} torrents, {1} shared info dicts'.format(count, len(info_hashes)))
+        self.stdout.write('Torrent size: {0} bytes, stored size: {1} bytes, saved: {2} bytes '
+                          '({3:.1f}%)'.format(logical_bytes, stored_bytes, saved_bytes,
+                                              100.0 * saved_bytes / logical_bytes
+                                              if logical_bytes else 0))
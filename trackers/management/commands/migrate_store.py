@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trackers.store import store_backends
+
+
+class Command(BaseCommand):
+    args = '<from_backend> <to_backend>'
+    help = 'Copies all torrents from one torrent store backend ({0}) to another.'.format(
+        ', '.join(sorted(store_backends)))
+    option_list = BaseCommand.option_list + (
+        make_option('--delete', action='store_true', dest='delete', default=False,
+                    help='Delete each torrent from the source store after copying it'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2 or any(a not in store_backends for a in args):
+            raise CommandError('Usage: migrate_store {0}'.format(self.args))
+        source = store_backends[args[0]]()
+        destination = store_backends[args[1]]()
+        count = 0
+        for announces_hash, info_hash in list(source.keys()):
+            destination.put(source.get(announces_hash, info_hash))
+            if options['delete']:
+                source.delete(announces_hash, info_hash)
+            count += 1
+            if count % 1000 == 0:
+                self.stdout.write('Migrated {0} torrents'.format(count))
+        self.stdout.write('Migrated {0} torrents from {1} to {2}'.format(count, *args))
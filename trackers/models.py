@@ -1,6 +1,6 @@
 from django.db import models
 
-from torrents.utils import encode_announces, decode_announces, hash_announces
+from torrents.utils import decode_announces, intern_announces
 
 
 class TrackerTorrentBase(models.Model):
@@ -26,5 +26,4 @@ class TrackerTorrentBase(models.Model):
 
     @announces.setter
     def announces(self, value):
-        self.announces_enc = encode_announces(value)
-        self.announces_hash = hash_announces(value)
+        self.announces_enc, self.announces_hash = intern_announces(value)
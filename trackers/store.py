@@ -1,42 +1,849 @@
+import asyncio
+from binascii import hexlify, unhexlify
+from concurrent.futures.thread import ThreadPoolExecutor
+import errno
+import fcntl
+import io
 import os
 import os.path
+import struct
+import tempfile
+import threading
+import zlib
 
 from WhatManager3 import settings
+from WhatManager3.utils import LRUCache
+from torrents.bencode import BTFailure
 from torrents.utils import TorrentInfo
 
 
-class TorrentStore(object):
-    def __init__(self, dir):
+# A torrent whose info dict is kept separately is stored as an envelope: this header, the bytes
+# before the info dict and the bytes after it. Torrent files always start with b'd'.
+ENVELOPE_MAGIC = b'E'
+ENVELOPE_HEADER = struct.Struct('<cI')
+
+
+def make_envelope(content, info_start, info_end):
+    return b''.join([ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, info_start), content[:info_start],
+                     content[info_end:]])
+
+
+def open_envelope(envelope, info):
+    prefix_end = ENVELOPE_HEADER.size + ENVELOPE_HEADER.unpack_from(envelope)[1]
+    return b''.join([envelope[ENVELOPE_HEADER.size:prefix_end], info, envelope[prefix_end:]])
+
+
+class StoreLock(object):
+    """
+    Serializes the writers of a store across threads and processes. Re-entrant: the outermost
+    acquire in a thread takes the thread lock and an exclusive flock of path, which may be a
+    directory.
+    """
+
+    def __init__(self, path, thread_lock=None):
+        self.path = path
+        self.thread_lock = thread_lock or threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            if self.depth == 0:
+                if os.path.isdir(self.path):
+                    fd = os.open(self.path, os.O_RDONLY)
+                else:
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except Exception:
+                    os.close(fd)
+                    raise
+                self.fd = fd
+            self.depth += 1
+        except Exception:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        self.thread_lock.release()
+
+
+class BaseTorrentStore(object):
+    """
+    Stores .torrent files keyed by (announces_hash, info_hash). Use create() to get the store
+    selected by settings.TORRENT_STORE_BACKEND.
+
+    With dedup_info, the info dict of every torrent is stored once per info_hash and each
+    announce variant only keeps a small envelope with the rest of the file, from which get()
+    rebuilds the exact original bytes.
+
+    Backends implement the raw entry operations (read, write_many, remove, exists, size, keys)
+    and provide a StoreLock as store_lock. An announces_hash of None addresses the shared info
+    dicts.
+    """
+
+    def __init__(self, dedup_info=False):
+        self.dedup_info = dedup_info
+
+    def read(self, announces_hash, info_hash):
+        """
+        :return: The raw stored entry. Raises an OSError if it doesn't exist.
+        """
+        raise NotImplementedError()
+
+    def write_many(self, entries):
+        """
+        :param entries: A list of (announces_hash, info_hash, data) to store, replacing any
+        existing entries with the same keys
+        """
+        raise NotImplementedError()
+
+    def remove(self, announces_hash, info_hash):
+        raise NotImplementedError()
+
+    def exists(self, announces_hash, info_hash):
+        raise NotImplementedError()
+
+    def size(self, announces_hash, info_hash):
+        """
+        :return: The size of the raw stored entry in bytes
+        """
+        raise NotImplementedError()
+
+    def matches(self, announces_hash, info_hash, data, skip=None):
+        """
+        :return: Whether the raw stored entry is data
+        :param skip: A (start, end) span of data that is known to be stored already and doesn't
+        need to be compared
+        """
+        return self.read(announces_hash, info_hash) == data
+
+    def is_info_referenced(self, info_hash):
+        """
+        :return: Whether any torrent still uses the shared info dict of info_hash. Backends that
+        can't answer this cheaply return True and drop unused info dicts some other way.
+        """
+        return True
+
+    def keys(self):
+        """
+        Iterates over the (announces_hash, info_hash) of all stored torrents.
+        """
+        raise NotImplementedError()
+
+    def info_hashes(self):
+        """
+        Iterates over the info_hash of all shared info dicts, including unused ones.
+        """
+        return iter(())
+
+    def check(self, announces_hash, info_hash):
+        """
+        Reads a stored torrent and verifies that it is a valid torrent with the given hashes.
+        :return: A description of the problem, None if the torrent is intact
+        """
+        try:
+            info = TorrentInfo.from_binary(self.get(announces_hash, info_hash))
+        except (OSError, BTFailure) as e:
+            return str(e)
+        except (KeyError, TypeError, UnicodeDecodeError):
+            return 'not a valid torrent'
+        if info.info_hash != info_hash.upper():
+            return 'has info_hash {0}'.format(info.info_hash)
+        if info.announces_hash != announces_hash.upper():
+            return 'has announces_hash {0}'.format(info.announces_hash)
+        return None
+
+    def get(self, announces_hash, info_hash):
+        """
+        :return: The torrent file contents. Raises an OSError if the torrent is not stored.
+        """
+        data = self.read(announces_hash, info_hash)
+        if data[:1] == ENVELOPE_MAGIC:
+            return open_envelope(data, self.read(None, info_hash))
+        return data
+
+    def open(self, announces_hash, info_hash):
+        """
+        Opens a stored torrent for streaming it without reading it into memory first, where the
+        backend allows it.
+        :return: A tuple of a binary file-like object with read and close, and its size
+        """
+        content = self.get(announces_hash, info_hash)
+        return io.BytesIO(content), len(content)
+
+    def get_file_path(self, announces_hash, info_hash):
+        """
+        :return: The path of the file that contains exactly the torrent, if there is one, so it
+        can be served by the web server. None if the backend does not store torrents that way.
+        """
+        return None
+
+    def get_many(self, keys):
+        """
+        :param keys: A list of (announces_hash, info_hash)
+        :return: A list with the contents of each torrent, None for the ones that are not stored
+        """
+        results = []
+        for announces_hash, info_hash in keys:
+            try:
+                results.append(self.get(announces_hash, info_hash))
+            except FileNotFoundError:
+                results.append(None)
+        return results
+
+    def put(self, content):
+        self.put_many([content])
+
+    def put_many(self, contents):
+        # Checking for the info dicts and writing the envelopes that rely on them happen under the
+        # lock, so another process can't remove an info dict in between
+        with self.store_lock:
+            entries = []
+            batch = {}
+            for content in contents:
+                info = TorrentInfo.from_binary_cached(content)
+                key = (info.announces_hash, info.info_hash)
+                start, end = info.info_span
+                if key in batch:
+                    if batch[key] != content:
+                        raise Exception('Trying to put a torrent with the same info_hash an '
+                                        'announces but different content')
+                    continue
+                batch[key] = content
+                if self.dedup_info:
+                    data, span = make_envelope(content, start, end), None
+                else:
+                    data, span = content, (start, end)
+                if self.exists(*key):
+                    # The info dict is the same, as the info_hash is, so only the rest is compared
+                    if not self.matches(key[0], key[1], data, span) and \
+                            self.get(*key) != content:
+                        raise Exception('Trying to put a torrent with the same info_hash an '
+                                        'announces but different content')
+                    continue
+                if self.dedup_info and (None, info.info_hash) not in batch and \
+                        not self.exists(None, info.info_hash):
+                    batch[(None, info.info_hash)] = None
+                    entries.append((None, info.info_hash, content[start:end]))
+                entries.append(key + (data,))
+            # Info dicts come first, so an envelope is never stored without its info dict
+            entries.sort(key=lambda entry: entry[0] is not None)
+            self.write_many(entries)
+
+    def delete(self, announces_hash, info_hash):
+        with self.store_lock:
+            self.remove(announces_hash, info_hash)
+            self.remove_unused_info(info_hash)
+
+    def remove_unused_info(self, info_hash):
+        """
+        Removes the shared info dict of info_hash if no torrent uses it.
+        :return: Whether it was removed
+        """
+        with self.store_lock:
+            if self.exists(None, info_hash) and not self.is_info_referenced(info_hash):
+                self.remove(None, info_hash)
+                return True
+            return False
+
+    @classmethod
+    def create(cls):
+        """
+        :return: The process-wide store of settings.TORRENT_STORE_BACKEND. It's shared because
+        the pack store reads its whole index when it's first used.
+        """
+        backend = settings.TORRENT_STORE_BACKEND
+        with shared_stores_lock:
+            store = shared_stores.get(backend)
+            if store is None:
+                store = store_backends[backend]()
+                if settings.STORE_CACHE_BYTES:
+                    store = CachingTorrentStore(store, get_store_cache())
+                shared_stores[backend] = store
+            return store
+
+
+class TorrentStore(BaseTorrentStore):
+    """
+    Stores every torrent in its own file under announces_hash/info_hash[:2]/ and shared info
+    dicts under info/info_hash[:2]/.
+    """
+
+    # Number of files written and synced together by write_many
+    WRITE_BATCH_SIZE = 256
+
+    def __init__(self, dir, dedup_info=False):
+        super(TorrentStore, self).__init__(dedup_info)
         self.dir = dir
+        os.makedirs(dir, exist_ok=True)
+        self.store_lock = StoreLock(dir)
 
     def get_path(self, announces_hash, info_hash):
         assert len(info_hash) == 40
+        if announces_hash is None:
+            return os.path.join(self.dir, 'info', info_hash[:2], info_hash + '.info')
         assert len(announces_hash) == 40
         return os.path.join(self.dir, announces_hash, info_hash[:2], info_hash + '.torrent')
 
-    def get(self, announces_hash, info_hash):
-        file_path = self.get_path(announces_hash, info_hash)
-        with open(file_path, 'rb') as f:
+    def read(self, announces_hash, info_hash):
+        with open(self.get_path(announces_hash, info_hash), 'rb') as f:
             return f.read()
 
-    def put(self, content):
-        info = TorrentInfo.from_binary(content)
-        file_path = self.get_path(info.announces_hash, info.info_hash)
-        if os.path.exists(file_path):
+    def write_many(self, entries):
+        """
+        Writes every entry to a temporary file next to its destination and renames them into place
+        once all of them are on disk, so a crash never leaves a partially written torrent behind.
+        Directories are created and synced once per batch.
+        """
+        for i in range(0, len(entries), self.WRITE_BATCH_SIZE):
+            self._write_batch(entries[i:i + self.WRITE_BATCH_SIZE])
+
+    def _write_batch(self, entries):
+        paths = [self.get_path(announces_hash, info_hash)
+                 for announces_hash, info_hash, data in entries]
+        dir_paths = set(os.path.dirname(path) for path in paths)
+        for dir_path in dir_paths:
+            os.makedirs(dir_path, exist_ok=True)
+        temp_files = []
+        try:
+            for path, (announces_hash, info_hash, data) in zip(paths, entries):
+                fd, temp_path = tempfile.mkstemp(
+                    prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(path))
+                temp_files.append((fd, temp_path))
+                os.fchmod(fd, 0o644)
+                with open(fd, 'wb', closefd=False) as f:
+                    f.write(data)
+            for fd, temp_path in temp_files:
+                os.fsync(fd)
+            for path, (fd, temp_path) in zip(paths, temp_files):
+                os.rename(temp_path, path)
+        except Exception:
+            for fd, temp_path in temp_files:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+        finally:
+            for fd, temp_path in temp_files:
+                os.close(fd)
+        for dir_path in dir_paths:
+            dir_fd = os.open(dir_path, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def remove(self, announces_hash, info_hash):
+        os.remove(self.get_path(announces_hash, info_hash))
+
+    def exists(self, announces_hash, info_hash):
+        return os.path.exists(self.get_path(announces_hash, info_hash))
+
+    def size(self, announces_hash, info_hash):
+        return os.path.getsize(self.get_path(announces_hash, info_hash))
+
+    def matches(self, announces_hash, info_hash, data, skip=None):
+        start, end = skip or (len(data), len(data))
+        with open(self.get_path(announces_hash, info_hash), 'rb') as f:
+            if os.fstat(f.fileno()).st_size != len(data) or f.read(start) != data[:start]:
+                return False
+            f.seek(end)
+            return f.read() == data[end:]
+
+    def is_info_referenced(self, info_hash):
+        return any(self.exists(announces_hash, info_hash) for announces_hash in os.listdir(self.dir)
+                   if len(announces_hash) == 40)
+
+    def open(self, announces_hash, info_hash):
+        f = open(self.get_path(announces_hash, info_hash), 'rb')
+        if f.read(1) == ENVELOPE_MAGIC:
+            f.close()
+            return super(TorrentStore, self).open(announces_hash, info_hash)
+        f.seek(0)
+        return f, os.fstat(f.fileno()).st_size
+
+    def get_file_path(self, announces_hash, info_hash):
+        file_path = self.get_path(announces_hash, info_hash)
+        try:
             with open(file_path, 'rb') as f:
-                if f.read() != content:
-                    raise Exception('Trying to put a torrent with the same info_hash an announces'
-                                    ' but different content')
-        dir_path = os.path.dirname(file_path)
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-        with open(file_path, 'wb') as f:
-            f.write(content)
+                if f.read(1) == ENVELOPE_MAGIC:
+                    return None
+        except FileNotFoundError:
+            pass
+        return file_path
+
+    def keys(self):
+        for announces_hash in os.listdir(self.dir):
+            if len(announces_hash) != 40:
+                continue
+            announces_path = os.path.join(self.dir, announces_hash)
+            for prefix in os.listdir(announces_path):
+                for filename in os.listdir(os.path.join(announces_path, prefix)):
+                    if filename.endswith('.torrent'):
+                        yield announces_hash, filename[:-len('.torrent')]
+
+    def info_hashes(self):
+        info_path = os.path.join(self.dir, 'info')
+        if not os.path.exists(info_path):
+            return
+        for prefix in os.listdir(info_path):
+            for filename in os.listdir(os.path.join(info_path, prefix)):
+                if filename.endswith('.info'):
+                    yield filename[:-len('.info')]
+
+
+class PackTorrentStore(BaseTorrentStore):
+    """
+    Appends torrents to large pack files instead of creating one file per torrent. Their
+    locations are kept in an append-only index log, which every process loads into memory and
+    follows as other processes append to it. Deleting only appends a tombstone to the index,
+    the space is reclaimed by compact().
+
+    Writers serialize on an exclusive flock of the lock file. Torrent data is always written
+    before its index record, so readers never see a record for incomplete data. Every entry
+    carries a CRC32, so data lost in a crash is detected on read instead of returned.
+    """
+
+    # announces_hash, info_hash, pack number, offset, length, crc32 of the content
+    INDEX_RECORD = struct.Struct('<20s20sIQII')
+    KEY_SIZE = 40
+    # Pack number used for the records of deleted torrents
+    TOMBSTONE = 0xFFFFFFFF
+    # announces_hash used in the index for shared info dicts
+    INFO_ANNOUNCES_HASH = bytes(20)
+    MAX_PACK_SIZE = 1024 ** 3
+
+    def __init__(self, dir, dedup_info=False):
+        super(PackTorrentStore, self).__init__(dedup_info)
+        self.dir = dir
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        self.index_path = os.path.join(dir, 'index')
+        self.lock_path = os.path.join(dir, 'lock')
+        self.entries = {}
+        self.index_ino = None
+        self.index_pos = 0
+        self.pack_fds = {}
+        # Guards the in-memory index and the open packs when used from several threads
+        self.thread_lock = threading.RLock()
+        self.store_lock = StoreLock(self.lock_path, self.thread_lock)
+
+    def get_pack_path(self, pack):
+        return os.path.join(self.dir, 'pack-{0:06}.pack'.format(pack))
+
+    def get_packs(self):
+        return sorted(int(f[5:11]) for f in os.listdir(self.dir)
+                      if f.startswith('pack-') and f.endswith('.pack'))
+
+    def _close_packs(self):
+        for fd in self.pack_fds.values():
+            os.close(fd)
+        self.pack_fds = {}
+
+    def _apply_records(self, data):
+        record_size = self.INDEX_RECORD.size
+        for i in range(0, len(data) - len(data) % record_size, record_size):
+            record = data[i:i + record_size]
+            if self.INDEX_RECORD.unpack(record)[2] == self.TOMBSTONE:
+                self.entries.pop(record[:self.KEY_SIZE], None)
+            else:
+                self.entries[record[:self.KEY_SIZE]] = record[self.KEY_SIZE:]
+        return len(data) - len(data) % record_size
+
+    def refresh(self):
+        """
+        Picks up index records appended by other processes. Reloads everything if the index was
+        replaced by compact().
+        """
+        with self.thread_lock:
+            try:
+                stat = os.stat(self.index_path)
+            except FileNotFoundError:
+                self.entries = {}
+                self.index_ino = None
+                self.index_pos = 0
+                return
+            if stat.st_ino != self.index_ino:
+                self.entries = {}
+                self.index_ino = stat.st_ino
+                self.index_pos = 0
+                self._close_packs()
+            if stat.st_size > self.index_pos:
+                with open(self.index_path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_ino != self.index_ino:
+                        # Replaced between the stat and the open, start over
+                        self.index_ino = None
+                        return self.refresh()
+                    f.seek(self.index_pos)
+                    self.index_pos += self._apply_records(f.read(stat.st_size - self.index_pos))
+
+    def _key(self, announces_hash, info_hash):
+        assert len(info_hash) == 40
+        if announces_hash is None:
+            return self.INFO_ANNOUNCES_HASH + unhexlify(info_hash)
+        assert len(announces_hash) == 40
+        return unhexlify(announces_hash) + unhexlify(info_hash)
+
+    def _location(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            raise FileNotFoundError(errno.ENOENT, 'Torrent is not in the store',
+                                    hexlify(key).decode().upper())
+        return self.INDEX_RECORD.unpack(key + entry)[2:]
+
+    def _read(self, key, length=None):
+        pack, offset, entry_length, crc = self._location(key)
+        fd = self.pack_fds.get(pack)
+        if fd is None:
+            fd = self.pack_fds[pack] = os.open(self.get_pack_path(pack), os.O_RDONLY)
+        if length is not None:
+            return os.pread(fd, min(length, entry_length), offset)
+        content = os.pread(fd, entry_length, offset)
+        if len(content) != entry_length or zlib.crc32(content) != crc:
+            raise IOError('Corrupted entry {0} in {1}'.format(
+                hexlify(key).decode().upper(), self.get_pack_path(pack)))
+        return content
+
+    def _read_retry(self, key, length=None):
+        with self.thread_lock:
+            self.refresh()
+            try:
+                return self._read(key, length)
+            except FileNotFoundError:
+                # The pack may have been removed by a compaction we haven't seen yet
+                self.index_ino = None
+                self.refresh()
+                return self._read(key, length)
+
+    def read(self, announces_hash, info_hash):
+        return self._read_retry(self._key(announces_hash, info_hash))
+
+    def exists(self, announces_hash, info_hash):
+        with self.thread_lock:
+            self.refresh()
+            return self._key(announces_hash, info_hash) in self.entries
+
+    def size(self, announces_hash, info_hash):
+        with self.thread_lock:
+            self.refresh()
+            return self._location(self._key(announces_hash, info_hash))[2]
+
+    def matches(self, announces_hash, info_hash, data, skip=None):
+        with self.thread_lock:
+            self.refresh()
+            pack, offset, length, crc = self._location(self._key(announces_hash, info_hash))
+        if length != len(data) or crc != zlib.crc32(data):
+            return False
+        # Equal CRC32s don't make equal content, the bytes decide
+        return self.read(announces_hash, info_hash) == data
+
+    def open(self, announces_hash, info_hash):
+        key = self._key(announces_hash, info_hash)
+        with self.thread_lock:
+            if self._read_retry(key, 1) == ENVELOPE_MAGIC:
+                return super(PackTorrentStore, self).open(announces_hash, info_hash)
+            pack, offset, length, crc = self._location(key)
+            return PackEntryFile(self.get_pack_path(pack), offset, length), length
+
+    def _append_index(self, records):
+        # Only called with the lock held. A crash while appending can leave a torn record at the
+        # end, which readers skip, so it is cut off before the new records end up after it.
+        with open(self.index_path, 'ab') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % self.INDEX_RECORD.size:
+                f.truncate(size - size % self.INDEX_RECORD.size)
+            f.write(b''.join(records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_many(self, entries):
+        with self.store_lock:
+            self.refresh()
+            packs = self.get_packs()
+            pack = packs[-1] if packs else 0
+            pack_path = self.get_pack_path(pack)
+            if os.path.exists(pack_path) and os.path.getsize(pack_path) >= self.MAX_PACK_SIZE:
+                pack += 1
+            records = []
+            f = open(self.get_pack_path(pack), 'ab')
+            try:
+                # A key that is already stored is replaced, the old data is reclaimed by compact()
+                for announces_hash, info_hash, data in entries:
+                    key = self._key(announces_hash, info_hash)
+                    if f.tell() >= self.MAX_PACK_SIZE:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        f.close()
+                        pack += 1
+                        f = open(self.get_pack_path(pack), 'ab')
+                    records.append(key + self.INDEX_RECORD.pack(
+                        b'', b'', pack, f.tell(), len(data), zlib.crc32(data))[self.KEY_SIZE:])
+                    f.write(data)
+                # The data has to be on disk before the index records that point to it
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            self._append_index(records)
+            self.refresh()
+
+    def remove(self, announces_hash, info_hash):
+        key = self._key(announces_hash, info_hash)
+        with self.store_lock:
+            self.refresh()
+            self._location(key)
+            self._append_index([self.INDEX_RECORD.pack(
+                key[:20], key[20:], self.TOMBSTONE, 0, 0, 0)])
+            self.refresh()
+
+    def keys(self):
+        with self.thread_lock:
+            self.refresh()
+            entries = list(self.entries)
+        for key in entries:
+            if key[:20] != self.INFO_ANNOUNCES_HASH:
+                yield hexlify(key[:20]).decode().upper(), hexlify(key[20:]).decode().upper()
+
+    def info_hashes(self):
+        with self.thread_lock:
+            self.refresh()
+            entries = list(self.entries)
+        for key in entries:
+            if key[:20] == self.INFO_ANNOUNCES_HASH:
+                yield hexlify(key[20:]).decode().upper()
+
+    def compact(self):
+        """
+        Copies all live torrents and the info dicts they use into new pack files, replaces the
+        index and removes the old packs. Other processes notice the new index on their next
+        operation.
+        :return: The number of bytes reclaimed
+        """
+        with self.store_lock:
+            self.refresh()
+            old_packs = self.get_packs()
+            old_size = sum(os.path.getsize(self.get_pack_path(p)) for p in old_packs)
+            used_infos = {key[20:] for key in self.entries if key[:20] != self.INFO_ANNOUNCES_HASH}
+            keys = [key for key in self.entries
+                    if key[:20] != self.INFO_ANNOUNCES_HASH or key[20:] in used_infos]
+            pack = old_packs[-1] + 1 if old_packs else 0
+            records = []
+            f = open(self.get_pack_path(pack), 'wb')
+            try:
+                for key in sorted(keys, key=self._location):
+                    content = self._read(key)
+                    if f.tell() >= self.MAX_PACK_SIZE:
+                        os.fsync(f.fileno())
+                        f.close()
+                        pack += 1
+                        f = open(self.get_pack_path(pack), 'wb')
+                    records.append(key + self.INDEX_RECORD.pack(
+                        b'', b'', pack, f.tell(), len(content), zlib.crc32(content)
+                    )[self.KEY_SIZE:])
+                    f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            temp_index_path = self.index_path + '.tmp'
+            with open(temp_index_path, 'wb') as index_file:
+                index_file.write(b''.join(records))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            os.rename(temp_index_path, self.index_path)
+            self._close_packs()
+            for old_pack in old_packs:
+                os.remove(self.get_pack_path(old_pack))
+            self.refresh()
+            new_size = sum(os.path.getsize(self.get_pack_path(p)) for p in self.get_packs())
+            return old_size - new_size
+
+
+class CachingTorrentStore(BaseTorrentStore):
+    """
+    Read-through cache in front of another store. Stored torrents never change, so the cache
+    only needs to be invalidated when they are put or deleted. Deletes done by other processes
+    are not seen, so a deleted torrent can still be served from memory until it is evicted.
+    """
+
+    def __init__(self, store, cache):
+        super(CachingTorrentStore, self).__init__(store.dedup_info)
+        self.store = store
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # Backend specific attributes, like dir or compact()
+        return getattr(self.store, name)
+
+    def get(self, announces_hash, info_hash):
+        key = (announces_hash, info_hash)
+        content = self.cache.get(key)
+        if content is None:
+            content = self.store.get(announces_hash, info_hash)
+            self.cache.put(key, content, len(content))
+        return content
+
+    def get_many(self, keys):
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, content in enumerate(results) if content is None]
+        if missing:
+            for i, content in zip(missing, self.store.get_many([keys[i] for i in missing])):
+                if content is not None:
+                    self.cache.put(keys[i], content, len(content))
+                results[i] = content
+        return results
+
+    def open(self, announces_hash, info_hash):
+        content = self.cache.get((announces_hash, info_hash))
+        if content is not None:
+            return io.BytesIO(content), len(content)
+        return self.store.open(announces_hash, info_hash)
+
+    def get_file_path(self, announces_hash, info_hash):
+        return self.store.get_file_path(announces_hash, info_hash)
+
+    def read(self, announces_hash, info_hash):
+        return self.store.read(announces_hash, info_hash)
+
+    def write_many(self, entries):
+        try:
+            self.store.write_many(entries)
+        finally:
+            for announces_hash, info_hash, data in entries:
+                self.cache.discard((announces_hash, info_hash))
+
+    def remove(self, announces_hash, info_hash):
+        self.cache.discard((announces_hash, info_hash))
+        self.store.remove(announces_hash, info_hash)
+
+    def exists(self, announces_hash, info_hash):
+        return self.store.exists(announces_hash, info_hash)
+
+    def matches(self, announces_hash, info_hash, data, skip=None):
+        return self.store.matches(announces_hash, info_hash, data, skip)
+
+    def size(self, announces_hash, info_hash):
+        return self.store.size(announces_hash, info_hash)
+
+    def put(self, content):
+        self.put_many([content])
+
+    def put_many(self, contents):
+        # Parsed before writing, so invalidating can't fail and hide an error of the write
+        keys = []
+        for content in contents:
+            info = TorrentInfo.from_binary_cached(content)
+            keys.append((info.announces_hash, info.info_hash))
+        try:
+            self.store.put_many(contents)
+        finally:
+            for key in keys:
+                self.cache.discard(key)
 
     def delete(self, announces_hash, info_hash):
-        file_path = self.get_path(announces_hash, info_hash)
-        os.remove(file_path)
+        self.cache.discard((announces_hash, info_hash))
+        self.store.delete(announces_hash, info_hash)
 
-    @classmethod
-    def create(cls):
-        return TorrentStore(os.path.join(settings.STORE_PATH, 'torrent'))
+    def keys(self):
+        return self.store.keys()
+
+    def info_hashes(self):
+        return self.store.info_hashes()
+
+    def check(self, announces_hash, info_hash):
+        return self.store.check(announces_hash, info_hash)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+store_cache = None
+# Backend name to the store create() returns for it
+shared_stores = {}
+shared_stores_lock = threading.Lock()
+
+
+def get_store_cache():
+    """
+    :return: The process-wide cache of torrent contents, shared by all stores from create()
+    """
+    global store_cache
+    if store_cache is None:
+        store_cache = LRUCache(settings.STORE_CACHE_BYTES)
+    return store_cache
+
+
+class AsyncTorrentStore(object):
+    """
+    Exposes a store to coroutines. Operations run on a dedicated I/O executor, so a slow disk
+    doesn't stall the event loop. At most max_pending operations are submitted to the executor
+    at a time, the rest wait on the loop.
+    """
+
+    def __init__(self, store, loop=None, max_workers=4, max_pending=16):
+        self.store = store
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.semaphore = asyncio.Semaphore(max_pending, loop=self.loop)
+
+    @asyncio.coroutine
+    def run(self, func, *args):
+        with (yield from self.semaphore):
+            return (yield from self.loop.run_in_executor(self.executor, func, *args))
+
+    @asyncio.coroutine
+    def get(self, announces_hash, info_hash):
+        return (yield from self.run(self.store.get, announces_hash, info_hash))
+
+    @asyncio.coroutine
+    def put(self, content):
+        return (yield from self.run(self.store.put, content))
+
+    @asyncio.coroutine
+    def delete(self, announces_hash, info_hash):
+        return (yield from self.run(self.store.delete, announces_hash, info_hash))
+
+    @asyncio.coroutine
+    def get_many(self, keys):
+        return (yield from self.run(self.store.get_many, keys))
+
+    @asyncio.coroutine
+    def put_many(self, contents):
+        return (yield from self.run(self.store.put_many, contents))
+
+
+class PackEntryFile(object):
+    """
+    Reads a single torrent out of a pack file. Deliberately has no fileno(), so servers that
+    use sendfile() for file-like responses don't send the rest of the pack.
+    """
+
+    def __init__(self, path, offset, length):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+store_backends = {
+    'files': lambda: TorrentStore(os.path.join(settings.STORE_PATH, 'torrent'),
+                                  settings.STORE_DEDUP_INFO),
+    'pack': lambda: PackTorrentStore(os.path.join(settings.STORE_PATH, 'pack'),
+                                     settings.STORE_DEDUP_INFO),
+}
@@ -1,14 +1,20 @@
 import asyncio
 import os
 import shutil
+import tempfile
+import threading
 from unittest import TestCase, mock
 import os.path
 import time
 
 from WhatManager3.settings import STORE_PATH
+from WhatManager3.utils import LRUCache
+from torrents import bencode
+from torrents.bencode import BTFailure
 from torrents.utils import TorrentInfo
 from trackers import rate_limiter
-from trackers.store import TorrentStore
+from trackers.store import TorrentStore, PackTorrentStore, AsyncTorrentStore, \
+    CachingTorrentStore, StoreLock, ENVELOPE_HEADER
 from trackers.whatcd.tests import music_torrent_data
 
 
@@ -32,6 +38,7 @@ class TorrentStoreTestCase(TestCase):
             STORE_PATH, 'torrent', info.announces_hash, info.info_hash[:2],
             info.info_hash + '.torrent')
         store = TorrentStore.create()
+        self.assertIs(TorrentStore.create(), store)
         self.assertFalse(os.path.exists(torrent_path))
         store.put(data)
         self.assertTrue(os.path.exists(torrent_path))
@@ -41,6 +48,245 @@ class TorrentStoreTestCase(TestCase):
         self.assertRaises(OSError, lambda: store.get(info.announces_hash, info.info_hash))
 
 
+def announce_variant(data, announce):
+    bdict = bencode.bdecode(data)
+    bdict.pop(b'announce-list', None)
+    bdict[b'announce'] = announce
+    return bencode.bencode(bdict)
+
+
+class DedupTorrentStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _test_dedup(self, store):
+        variants = [announce_variant(music_torrent_data, b'http://tracker/' + passkey)
+                    for passkey in [b'a', b'b']]
+        infos = [TorrentInfo.from_binary(data) for data in variants]
+        info_hash = infos[0].info_hash
+        start, end = infos[0].info_span
+        store.put_many(variants)
+        store.put(variants[0])
+        for info, data in zip(infos, variants):
+            self.assertEqual(store.get(info.announces_hash, info_hash), data)
+            self.assertEqual(store.size(info.announces_hash, info_hash),
+                             ENVELOPE_HEADER.size + len(data) - (end - start))
+            f, size = store.open(info.announces_hash, info_hash)
+            self.assertEqual((f.read(), size), (data, len(data)))
+            f.close()
+        self.assertEqual(store.size(None, info_hash), end - start)
+        self.assertEqual(sorted(store.keys()),
+                         sorted((info.announces_hash, info_hash) for info in infos))
+        store.delete(infos[0].announces_hash, info_hash)
+        self.assertEqual(store.get(infos[1].announces_hash, info_hash), variants[1])
+        store.delete(infos[1].announces_hash, info_hash)
+        return info_hash
+
+    def test_files(self):
+        store = TorrentStore(self.dir, dedup_info=True)
+        info_hash = self._test_dedup(store)
+        self.assertFalse(store.exists(None, info_hash))
+
+    def test_pack(self):
+        store = PackTorrentStore(self.dir, dedup_info=True)
+        self._test_dedup(store)
+        store.compact()
+        self.assertEqual(store.entries, {})
+
+    def test_store_lock(self):
+        store = TorrentStore(self.dir, dedup_info=True)
+        # Another process locks the store through its own file descriptor
+        other_lock = StoreLock(self.dir)
+        locked = threading.Event()
+
+        def lock():
+            with other_lock:
+                locked.set()
+        with store.store_lock:
+            with store.store_lock:
+                thread = threading.Thread(target=lock)
+                thread.start()
+            self.assertFalse(locked.wait(0.1))
+        thread.join()
+        self.assertTrue(locked.is_set())
+
+
+class PutManyTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _test_put_many(self, store):
+        variants = [announce_variant(music_torrent_data, b'http://tracker/' + passkey)
+                    for passkey in [b'a', b'b', b'c']]
+        store.put_many(variants[:2])
+        store.put_many(variants + variants[1:])
+        self.assertEqual(len(list(store.keys())), 3)
+        bdict = bencode.bdecode(variants[0])
+        bdict[b'comment'] = b'changed'
+        self.assertRaises(Exception, lambda: store.put(bencode.bencode(bdict)))
+        for data in variants:
+            info = TorrentInfo.from_binary(data)
+            self.assertEqual(store.get(info.announces_hash, info.info_hash), data)
+
+    def test_files(self):
+        for dedup_info in [False, True]:
+            store = TorrentStore(os.path.join(self.dir, str(dedup_info)), dedup_info)
+            self._test_put_many(store)
+            # Temporary files are named .<name>.<random>
+            for dir_path, dir_names, file_names in os.walk(store.dir):
+                self.assertEqual([f for f in file_names if f.startswith('.')], [])
+
+    def test_pack(self):
+        self._test_put_many(PackTorrentStore(self.dir))
+
+
+class StoreCheckTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_check(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        store = TorrentStore(self.dir)
+        store.put(data)
+        self.assertIsNone(store.check(info.announces_hash, info.info_hash))
+        self.assertIsNotNone(store.check(info.announces_hash, 'A' * 40))
+        store.write_many([('A' * 40, info.info_hash, data)])
+        self.assertEqual(store.check('A' * 40, info.info_hash),
+                         'has announces_hash {0}'.format(info.announces_hash))
+        store.write_many([(info.announces_hash, info.info_hash, data[:-1])])
+        self.assertIsNotNone(store.check(info.announces_hash, info.info_hash))
+
+
+class PackTorrentStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_get_delete(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        store = PackTorrentStore(self.dir)
+        other_store = PackTorrentStore(self.dir)
+        store.put(data)
+        store.put(data)
+        self.assertEqual(other_store.get(info.announces_hash, info.info_hash), data)
+        self.assertEqual(list(other_store.keys()), [(info.announces_hash, info.info_hash)])
+        other_store.delete(info.announces_hash, info.info_hash)
+        self.assertRaises(OSError, lambda: store.get(info.announces_hash, info.info_hash))
+        self.assertEqual(list(store.keys()), [])
+
+    def test_compact(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        store = PackTorrentStore(self.dir)
+        other_store = PackTorrentStore(self.dir)
+        store.put(data)
+        store.delete(info.announces_hash, info.info_hash)
+        store.put(data)
+        self.assertEqual(other_store.get(info.announces_hash, info.info_hash), data)
+        self.assertEqual(store.compact(), len(data))
+        self.assertEqual(other_store.get(info.announces_hash, info.info_hash), data)
+
+    def test_torn_index(self):
+        data = music_torrent_data
+        other_data = announce_variant(data, b'http://tracker/other')
+        store = PackTorrentStore(self.dir)
+        store.put(data)
+        with open(store.index_path, 'ab') as f:
+            f.write(b'\xff' * (PackTorrentStore.INDEX_RECORD.size // 2))
+        store.put(other_data)
+        self.assertEqual(os.path.getsize(store.index_path) % PackTorrentStore.INDEX_RECORD.size, 0)
+        new_store = PackTorrentStore(self.dir)
+        for torrent_data in [data, other_data]:
+            info = TorrentInfo.from_binary(torrent_data)
+            self.assertEqual(new_store.get(info.announces_hash, info.info_hash), torrent_data)
+
+    def test_matches(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        other_data = data[:-4] + b'2eee'
+        # Every CRC32 collides, so the content has to be compared
+        with mock.patch('zlib.crc32', return_value=0):
+            store = PackTorrentStore(self.dir)
+            store.put(data)
+            self.assertTrue(store.matches(info.announces_hash, info.info_hash, data))
+            self.assertFalse(store.matches(info.announces_hash, info.info_hash, other_data))
+            self.assertFalse(store.matches(info.announces_hash, info.info_hash, data[:-1]))
+
+
+class CachingTorrentStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cache(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        store = CachingTorrentStore(PackTorrentStore(self.dir), LRUCache(1024 * 1024))
+        store.put(data)
+        self.assertEqual(store.get(info.announces_hash, info.info_hash), data)
+        self.assertEqual(store.get(info.announces_hash, info.info_hash), data)
+        self.assertEqual((store.cache.hits, store.cache.misses), (1, 1))
+        self.assertEqual(store.get_many([(info.announces_hash, info.info_hash)]), [data])
+        self.assertEqual(store.cache.hits, 2)
+        store.delete(info.announces_hash, info.info_hash)
+        self.assertRaises(OSError, lambda: store.get(info.announces_hash, info.info_hash))
+        self.assertEqual(store.cache.bytes, 0)
+
+    def test_put_many_error(self):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        store = CachingTorrentStore(PackTorrentStore(self.dir, True), LRUCache(1024 * 1024))
+        self.assertTrue(store.dedup_info)
+        self.assertRaises(BTFailure, lambda: store.put_many([data, data[:-1]]))
+        self.assertEqual(list(store.keys()), [])
+        store.put(data)
+        bdict = bencode.bdecode(data)
+        bdict[b'comment'] = b'changed'
+        self.assertRaisesRegex(Exception, 'different content',
+                               lambda: store.put_many([bencode.bencode(bdict)]))
+        self.assertEqual(store.get(info.announces_hash, info.info_hash), data)
+
+
+class AsyncTorrentStoreTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @asyncio.coroutine
+    def _test_get_put_coro(self, store):
+        data = music_torrent_data
+        info = TorrentInfo.from_binary(data)
+        yield from store.put_many([data])
+        self.assertEqual((yield from store.get(info.announces_hash, info.info_hash)), data)
+        self.assertEqual(
+            (yield from store.get_many([(info.announces_hash, info.info_hash), ('A' * 40,) * 2])),
+            [data, None]
+        )
+        yield from store.delete(info.announces_hash, info.info_hash)
+
+    def test_get_put(self):
+        loop = asyncio.get_event_loop()
+        store = AsyncTorrentStore(PackTorrentStore(self.dir), loop)
+        loop.run_until_complete(self._test_get_put_coro(store))
+
+
 class RateLimiterTestCase(TestCase):
     @asyncio.coroutine
     def _test_rate_limiter_coro(self, mock_sleep, mock_time):
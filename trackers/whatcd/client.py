@@ -7,7 +7,7 @@ from django.db import transaction
 from WhatManager3.utils import db_func, prune_connections, json_dumps
 from torrents.models import ClientTorrent, QueuedTorrent, DownloadLocation
 from torrents.utils import TorrentInfo
-from trackers.store import TorrentStore
+from trackers.store import TorrentStore, AsyncTorrentStore
 from trackers.whatcd.api import WhatAPI
 from trackers.whatcd.models import TrackerTorrent, FreeleechTorrent, Settings
 
@@ -20,15 +20,15 @@ class TrackerClient(object):
     def __init__(self, settings):
         self.settings = settings
         self.client = WhatAPI(self.settings.username, self.settings.password)
+        self.store = AsyncTorrentStore(TorrentStore.create())
 
     @asyncio.coroutine
     @db_func
     def fetch_metadata(self, torrent_id):
-        store = TorrentStore.create()
         response = yield from self.client.request('torrent', id=torrent_id)
         _, torrent_data = yield from self.client.get_torrent(torrent_id)
-        info = TorrentInfo.from_binary(torrent_data)
-        store.put(torrent_data)
+        info = TorrentInfo.from_binary_cached(torrent_data)
+        yield from self.store.put(torrent_data)
         torrent = TrackerTorrent.from_response(response, info)
         torrent.save()
         return torrent